@@ -9,9 +9,18 @@ try:
 except:
     from xml.etree import ElementTree
 
+import csv
+import io
 import json
+import os
 import re
+import datetime
 import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import gettempdir
+from threading import Condition, local
 from ducttape.httpsession import HTTPSession
 import pandas as pd
 import numpy as np
@@ -26,9 +35,241 @@ LOGGER = logging.getLogger('sps-automation.data_sources.googlesheets')
 
 MAGIC_NUMBER = 64
 UPLOAD_BATCH_SIZE = 1000
+# ways replace_worksheet_with_dataframe can send data: JSON values arrays, or delimited text for pasteData requests
+UPLOAD_ENGINES = ('values', 'paste')
+# rows fetched per request when streaming a worksheet
+DOWNLOAD_WINDOW_SIZE = 10000
+# the Sheets API rejects request bodies over ~10MB, and Google recommends keeping them under 2MB
+UPLOAD_PAYLOAD_BUDGET = 2 * 1024 * 1024
+# the JSON around the packed value ranges in a values:batchUpdate body
+VALUES_BATCHUPDATE_ENVELOPE = '{{"valueInputOption": "RAW", "data": [{}]}}'
+# retries of a throttled upload request, with truncated exponential backoff as recommended by Google
+MAX_UPLOAD_RETRIES = 5
+MAX_UPLOAD_BACKOFF = 64
+# row hashes of the last sync of each worksheet, kept in the temp folder between runs
+SYNC_MANIFEST_FILENAME = 'googlesheets_sync_manifest.json'
+# field masks so that metadata requests only return the sheets' properties rather than the whole spreadsheet
+SHEET_PROPERTIES_FIELDS = 'sheets.properties'
+BATCHUPDATE_RESPONSE_FIELDS = 'spreadsheetId,replies,updatedSpreadsheet.sheets.properties'
 CELL_ADDR_RE = re.compile(r'([A-Za-z]+)([1-9]\d*)')
 
 
+def _to_json_value(value):
+    """Converts a single cell value that json can't serialize (numpy scalars, dates) to one it can."""
+    if isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return str(value)
+    else:
+        return value
+
+
+def _dataframe_to_upload_values(df):
+    """Converts a DataFrame into a 2d numpy object array of cell values that can be sent to the Sheets API.
+
+    The conversion is done a column at a time: missing values (NaN, NaT, None) become None, numpy scalars
+    become Python scalars and datetimes and timedeltas become ISO 8601 style strings
+    (e.g. '2019-08-01 10:15:00'). Slices of the result can be turned into rows with .tolist().
+    """
+    values = df.to_numpy(dtype=object, copy=True)
+    for ix in range(df.shape[1]):
+        column = df.iloc[:, ix]
+        if pd.api.types.is_datetime64_any_dtype(column) or pd.api.types.is_timedelta64_dtype(column):
+            values[:, ix] = column.astype(str).to_numpy(dtype=object)
+        elif column.dtype == object:
+            # numeric and boolean columns are already Python scalars, so only object columns need checking
+            values[:, ix] = [_to_json_value(value) for value in values[:, ix]]
+    values[pd.isna(df).to_numpy()] = None
+
+    return values
+
+
+def _to_cell_data(value):
+    """Converts a cell value (see _dataframe_to_upload_values) to a CellData dict for an updateCells request."""
+    if value is None:
+        # a cell with no userEnteredValue is cleared by an updateCells request with a userEnteredValue field mask
+        return {}
+    elif isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    elif isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    else:
+        return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def _column_values_to_series(column_values, num_rows):
+    """Builds a Series from one column of a COLUMNS value range, padded with NaN to num_rows.
+
+    Blank and whitespace-only strings become NaN, and the Series gets the narrowest dtype that fits its values
+    (e.g. float64 for a column of numbers), so numeric columns don't stay as Python objects.
+    """
+    values = np.full(num_rows, np.nan, dtype=object)
+    column_values = column_values[:num_rows]
+    values[:len(column_values)] = column_values
+
+    # only columns with strings in them can have blank cells, and most data columns don't
+    if pd.api.types.infer_dtype(values, skipna=True) not in ('integer', 'floating', 'mixed-integer-float',
+                                                              'boolean', 'empty'):
+        is_blank = np.fromiter((isinstance(value, str) and not value.strip() for value in values), dtype=bool,
+                               count=num_rows)
+        values[is_blank] = np.nan
+
+    return pd.Series(values).infer_objects()
+
+
+def _rows_to_delimited_text(rows, delimiter=','):
+    """Writes rows of cell values as delimited text for a pasteData request. None is written as an empty cell."""
+    text = io.StringIO()
+    csv.writer(text, delimiter=delimiter, lineterminator='\n').writerows(rows)
+
+    return text.getvalue()
+
+
+def _to_hash_value(value):
+    """Normalises a cell value before it is hashed, so that a value read back from the Sheets API hashes the same
+    as the value that was uploaded: the API returns integral numbers as ints and empty cells as ''."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    elif isinstance(value, str) and value == '':
+        return None
+    else:
+        return value
+
+
+def _hash_upload_rows(values):
+    """Hashes each row of a 2d numpy object array of cell values (see _dataframe_to_upload_values).
+
+    Numbers are hashed as floats and '' as None (see _to_hash_value), so 1 and 1.0 hash the same.
+
+    :returns: A numpy array of uint64 hashes, one per row.
+    """
+    if len(values) == 0:
+        return np.array([], dtype=np.uint64)
+
+    normalized_values = np.frompyfunc(_to_hash_value, 1, 1)(values)
+
+    return pd.util.hash_pandas_object(pd.DataFrame(normalized_values), index=False).to_numpy()
+
+
+def _find_changed_row_runs(old_hashes, new_hashes):
+    """Finds the runs of consecutive rows whose hashes differ between two uploads.
+
+    Rows that are only in new_hashes count as changed; rows that are only in old_hashes are ignored.
+
+    :returns: A list of (start, stop) row index tuples.
+    """
+    changed = np.ones(len(new_hashes), dtype=bool)
+    num_common = min(len(old_hashes), len(new_hashes))
+    changed[:num_common] = np.asarray(old_hashes[:num_common], dtype=np.uint64) != new_hashes[:num_common]
+
+    # the edges of the runs are where the mask flips
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], changed, [False])).astype(np.int8)))
+
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _iter_upload_batches(values, header=None, batch_size=UPLOAD_BATCH_SIZE):
+    """Splits rows of cell values into batches for upload.
+
+    :param values: A 2d numpy object array of cell values (see _dataframe_to_upload_values).
+    :param header: A list of column headers to put above the first row, or None.
+    :param batch_size: The maximum number of rows (including the header) in a batch.
+    :returns: A generator of (row_offset, rows) tuples, where row_offset is the position of the first row
+              in the batch relative to the first row of the upload.
+    """
+    header_rows = [header] if header is not None else []
+    row_offset = len(header_rows)
+    start = 0
+    while header_rows or start < len(values):
+        stop = start + batch_size - len(header_rows)
+        rows = header_rows + values[start:stop].tolist()
+        yield row_offset + start - len(header_rows), rows
+        header_rows = []
+        start = stop
+
+
+def _pack_value_ranges(serialized_value_ranges, payload_budget=UPLOAD_PAYLOAD_BUDGET):
+    """Groups serialized value ranges so that each group fits in one values:batchUpdate request.
+
+    :param serialized_value_ranges: A list of (value_range, json_string) tuples.
+    :param payload_budget: The maximum size, in bytes, of a request body. A single value range
+                           that is larger than the budget is put in a group by itself.
+    :returns: A generator of lists of (value_range, json_string) tuples.
+    """
+    envelope_size = len(VALUES_BATCHUPDATE_ENVELOPE.format(''))
+    pack = []
+    pack_size = envelope_size
+    for value_range, serialized in serialized_value_ranges:
+        # +1 for the comma separating it from the previous range
+        size = len(serialized.encode('utf-8')) + 1
+        if pack and pack_size + size > payload_budget:
+            yield pack
+            pack = []
+            pack_size = envelope_size
+        pack.append((value_range, serialized))
+        pack_size += size
+
+    if pack:
+        yield pack
+
+
+def _is_payload_limit_error(error):
+    """Returns True if a RequestError was raised because the request body was too large."""
+    if not error.args:
+        return False
+    status_code = error.args[0]
+    message = str(error.args[-1]).lower()
+
+    return status_code == 413 or 'payload size exceeds' in message
+
+
+def _is_rate_limit_error(error):
+    """Returns True if a RequestError was raised because a rate limit or quota was exceeded."""
+    if not error.args:
+        return False
+    status_code = error.args[0]
+    message = str(error.args[-1]).lower()
+
+    return status_code == 429 or (status_code == 403 and 'ratelimitexceeded' in message)
+
+
+class _AdaptiveConcurrencyLimiter(object):
+    """Limits the number of requests in flight, adjusting the limit to the responses it sees.
+
+    The limit starts at one request and grows by one for every successful request (doubling each round)
+    until a request is first throttled. From then on it is halved whenever a request is throttled and grows
+    by about one per round of successful requests, so concurrent uploads settle just under the API's quota
+    rather than starting with a burst that the quota may not allow.
+
+    :param max_limit: The most requests that may be in flight at once.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = 1.0
+        self.ramping_up = True
+        self.in_flight = 0
+        self.condition = Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.ramping_up = False
+                self.limit = max(1.0, self.limit / 2)
+            elif self.ramping_up:
+                self.limit = min(float(self.max_limit), self.limit + 1)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
 class GoogleSpreadsheet(object):
     """An instance of this class communicates with Google Data API.
     
@@ -36,16 +277,21 @@ class GoogleSpreadsheet(object):
                  oauth2client library. https://github.com/google/oauth2client
     :param http_session: (optional) A session object capable of making HTTP requests while persisting headers.
                                     Defaults to :class:`~ducttape.httpsession.HTTPSession`.
+    :param sync_manifest_path: (optional) The file sync_worksheet_with_dataframe saves its row hashes to.
+                               Defaults to a file in the system temp folder.
     
     >>> c = ducttape.data_sources.GoogleSpreadSheet(auth=OAuthCredentialObject)
     
     """
 
-    def __init__(self, auth, http_session=None):
+    def __init__(self, auth, http_session=None, sync_manifest_path=None):
         self.logger = logging.getLogger('sps-automation.data_sources.googlesheets.GoogleSpreadsheet')
         self.logger.debug('creating instance of GoogleSpreadsheet')
         self.auth = auth
         self.session = http_session or HTTPSession()
+        self.sync_manifest_path = sync_manifest_path
+        # sheet properties keyed by spreadsheet id, then sheet title
+        self._sheet_properties_cache = dict()
         self._login()
 
     def _ensure_xml_header(self, data):
@@ -112,6 +358,163 @@ class GoogleSpreadsheet(object):
 
         return df_worksheet_range
 
+    def download_worksheet_ranges(self, spreadsheet_id, ranges_a1_notation, header_row=None):
+        """Downloads several ranges in one request, building each DataFrame a column at a time.
+
+        Values are downloaded unformatted, so numbers arrive as numbers and numeric columns get a numeric
+        dtype, while dates and times arrive as formatted strings. Blank cells become NaN. Columns to the right
+        of the last header are dropped, as in download_worksheet_range.
+
+        :param spreadsheet_id: The id of the spreadsheet to download from.
+        :param ranges_a1_notation: A list of ranges in A1 notation, e.g. ["'Roster'!A1:F", "'Config'!A:B"].
+        :param header_row: The index of the row in each range that holds the column names. Defaults to 0.
+        :returns: A list of DataFrames, one for each range, in the same order as the ranges.
+        """
+        header_index = header_row or 0
+
+        self.logger.info('downloading spreadsheet: {}; ranges: {}; header_index: {}'.format(spreadsheet_id,
+                                                                                             ranges_a1_notation,
+                                                                                             header_index))
+
+        req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}/values:batchGet".format(spreadsheet_id)
+        params = {
+            'ranges': list(ranges_a1_notation),
+            'majorDimension': 'COLUMNS',
+            'valueRenderOption': 'UNFORMATTED_VALUE',
+            'dateTimeRenderOption': 'FORMATTED_STRING'
+        }
+
+        self.logger.debug('sending GET request: {}; params: {}'.format(req_url, params))
+
+        response = self.session.get(req_url, params=params)
+
+        self.logger.debug('response status: {}'.format(response.status_code))
+
+        if not response.ok:
+            raise RequestError(response.status_code, "{0}: {1}".format(response.status_code, response.content))
+
+        value_ranges = json.loads(response.content.decode('utf-8')).get('valueRanges', [])
+
+        return [self._column_value_range_to_dataframe(value_range, header_index) for value_range in value_ranges]
+
+    def iter_worksheet_dataframes(self, spreadsheet_id, worksheet_name, header_row=None,
+                                  window_size=DOWNLOAD_WINDOW_SIZE):
+        """Streams a worksheet as a series of DataFrames, fetching a window of rows at a time.
+
+        The windows are planned from the worksheet's dimensions, which are fetched again rather than taken from
+        the metadata cache, since rows may have been added by something else. While one window is being
+        converted, the next is downloaded in the background, so only about two windows are in memory at once
+        however large the worksheet is. Values are read as in download_worksheet_ranges, so dtypes are inferred
+        per window and may differ between windows (e.g. a column with no numbers in one window will be object,
+        not float).
+
+        Each DataFrame's index continues from the previous one's, so concatenating them gives the whole sheet.
+        Runs of blank rows are yielded as all-NaN DataFrames, and blank rows at the end of the sheet aren't
+        yielded at all.
+
+        :param spreadsheet_id: The id of the spreadsheet to download from.
+        :param worksheet_name: The title of the worksheet to download.
+        :param header_row: The index of the row that holds the column names. Defaults to 0.
+        :param window_size: The number of rows to fetch per request.
+        :returns: A generator of DataFrames.
+        """
+        header_index = header_row or 0
+        self.clear_metadata_cache(spreadsheet_id)
+        num_rows, num_columns = self.get_worksheet_dimensions(spreadsheet_id, worksheet_name)
+        end_col_index = num_columns - 1
+
+        self.logger.info('streaming sheet: {} in spreadsheet_id: {} in windows of {} rows'.format(
+            worksheet_name, spreadsheet_id, window_size
+        ))
+
+        header_columns = self._get_column_values(spreadsheet_id, worksheet_name, header_index, 0,
+                                                 header_index, end_col_index)
+        headers = [column[0] if column else '' for column in header_columns]
+        while headers and headers[-1] == '':
+            headers.pop()
+
+        window_starts = range(header_index + 1, num_rows, window_size)
+        row_offset = 0
+        blank_rows = 0
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            def fetch_window(start_row_index):
+                end_row_index = min(start_row_index + window_size, num_rows) - 1
+                return executor.submit(self._get_column_values, spreadsheet_id, worksheet_name, start_row_index, 0,
+                                       end_row_index, len(headers) - 1)
+
+            next_window = fetch_window(window_starts[0]) if window_starts and headers else None
+            for ix in range(len(window_starts) if headers else 0):
+                columns = next_window.result()
+                if ix + 1 < len(window_starts):
+                    next_window = fetch_window(window_starts[ix + 1])
+
+                window_rows = min(window_size, num_rows - window_starts[ix])
+                num_window_rows = max([len(column) for column in columns] + [0])
+
+                if num_window_rows and blank_rows:
+                    # blank rows are only yielded once there's data after them
+                    yield pd.DataFrame(np.nan, index=pd.RangeIndex(row_offset, row_offset + blank_rows),
+                                       columns=headers)
+                    row_offset += blank_rows
+                    blank_rows = 0
+
+                if num_window_rows:
+                    df_window = pd.DataFrame({
+                        col_ix: _column_values_to_series(columns[col_ix] if col_ix < len(columns) else [],
+                                                         num_window_rows)
+                        for col_ix in range(len(headers))
+                    }, columns=range(len(headers)))
+                    df_window.columns = headers
+                    df_window.index = pd.RangeIndex(row_offset, row_offset + num_window_rows)
+                    yield df_window
+                    row_offset += num_window_rows
+
+                blank_rows += window_rows - num_window_rows
+
+    def _get_column_values(self, spreadsheet_id, worksheet_name, start_row_index, start_col_index,
+                           end_row_index, end_col_index):
+        """Reads the unformatted values of a range as a list of columns, each without its trailing empty cells."""
+        range_a1_notation = "'{}'!{}:{}".format(worksheet_name,
+                                                self._rowcol_index_to_a1(start_row_index, start_col_index),
+                                                self._rowcol_index_to_a1(end_row_index, end_col_index))
+        req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}/values/{}".format(spreadsheet_id, range_a1_notation)
+        params = {
+            'majorDimension': 'COLUMNS',
+            'valueRenderOption': 'UNFORMATTED_VALUE',
+            'dateTimeRenderOption': 'FORMATTED_STRING'
+        }
+
+        self.logger.debug('sending GET request: {}; params: {}'.format(req_url, params))
+
+        response = self.session.get(req_url, params=params)
+
+        self.logger.debug('response status: {}'.format(response.status_code))
+
+        if not response.ok:
+            raise RequestError(response.status_code, "{0}: {1}".format(response.status_code, response.content))
+
+        return json.loads(response.content.decode('utf-8')).get('values', [])
+
+    def _column_value_range_to_dataframe(self, value_range, header_index=0):
+        # the API leaves out trailing empty columns and trailing empty cells in each column
+        columns = value_range.get('values', [])
+
+        # like download_worksheet_range, the frame is as wide as the header row
+        headers = [column[header_index] if len(column) > header_index else '' for column in columns]
+        while headers and headers[-1] == '':
+            headers.pop()
+        columns = columns[:len(headers)]
+
+        num_rows = max([len(column) - header_index - 1 for column in columns] + [0])
+
+        df_worksheet_range = pd.DataFrame({
+            ix: _column_values_to_series(column[header_index + 1:], num_rows) for ix, column in enumerate(columns)
+        }, index=pd.RangeIndex(num_rows), columns=range(len(columns)))
+        df_worksheet_range.columns = headers
+
+        return df_worksheet_range
+
     def clear_worksheet_range(self, spreadsheet_id, range_a1_notation):
         self.logger.info('clearing worksheet range for spreadsheet_id: {}; range: {}'.format(spreadsheet_id,
                                                                                               range_a1_notation))
@@ -133,54 +536,63 @@ class GoogleSpreadsheet(object):
     def get_worksheet_dimensions(self, spreadsheet_id, worksheet_name):
         self.logger.info('getting worksheet dimensions for sheet: {} in spreadsheet_id: {}'.format(worksheet_name,
                                                                                                     spreadsheet_id))
-        req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}".format(spreadsheet_id)
-        req_params = {'includeGridData': 'False'}
+        grid_properties = self._get_sheet_properties(spreadsheet_id, worksheet_name)['gridProperties']
 
-        self.logger.debug('sending GET request: {}; params: '.format(req_url, req_params))
+        return grid_properties['rowCount'], grid_properties['columnCount']
 
-        response = self.session.get(req_url, params=req_params)
+    def get_worksheet_id(self, spreadsheet_id, worksheet_name):
+        self.logger.info('getting worksheet id for spreadsheet_id: {}; sheet_name: {}'.format(spreadsheet_id,
+                                                                                              worksheet_name))
+        return self._get_sheet_properties(spreadsheet_id, worksheet_name)['sheetId']
 
-        self.logger.debug('response status: {}'.format(response.status_code))
-        self.logger.debug('response content: {}'.format(response.content))
+    def clear_metadata_cache(self, spreadsheet_id=None):
+        """Forgets the cached sheet properties of a spreadsheet, or of every spreadsheet if none is given.
 
-        if not response.ok:
-            raise RequestError
+        Changes made through this object keep the cache up to date; this is only needed when a spreadsheet's
+        sheets are added, removed or resized by something else.
+        """
+        if spreadsheet_id is None:
+            self._sheet_properties_cache.clear()
+        else:
+            self._sheet_properties_cache.pop(spreadsheet_id, None)
 
-        spreadsheet = json.loads(response.content.decode('utf-8'))
+    def _get_sheet_properties(self, spreadsheet_id, worksheet_name):
+        """Looks up a sheet's properties (sheetId, title, gridProperties, ...) in the metadata cache.
 
-        sheets = spreadsheet['sheets']
+        The cache is filled on first use, and refreshed once if the sheet isn't in it in case it was added since.
+        """
+        sheet_properties = self._sheet_properties_cache.get(spreadsheet_id)
+        if sheet_properties is None or worksheet_name not in sheet_properties:
+            sheet_properties = self._fetch_sheet_properties(spreadsheet_id)
 
-        for sheet in sheets:
-            if sheet['properties']['title'] == worksheet_name:
-                grid_properties = sheet['properties']['gridProperties']
-                return grid_properties['rowCount'], grid_properties['columnCount']
+        if worksheet_name not in sheet_properties:
+            raise WorksheetNotFound
 
-        raise WorksheetNotFound
+        return sheet_properties[worksheet_name]
 
-    def get_worksheet_id(self, spreadsheet_id, worksheet_name):
-        self.logger.info('getting worksheet id for spreadsheet_id: {}; sheet_name: {}'.format(spreadsheet_id,
-                                                                                              worksheet_name))
+    def _fetch_sheet_properties(self, spreadsheet_id):
         req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}".format(spreadsheet_id)
+        req_params = {'fields': SHEET_PROPERTIES_FIELDS}
 
-        self.logger.debug('sending GET request: {};'.format(req_url))
+        self.logger.debug('sending GET request: {}; params: {}'.format(req_url, req_params))
 
-        response = self.session.get(req_url)
+        response = self.session.get(req_url, params=req_params)
 
         self.logger.debug('response status: {}'.format(response.status_code))
         self.logger.debug('response content: {}'.format(response.content))
 
         if not response.ok:
-            raise RequestError
-
-        spreadsheet = json.loads(response.content.decode('utf-8'))
+            raise RequestError(response.status_code, "{0}: {1}".format(response.status_code, response.content))
 
-        sheets = spreadsheet['sheets']
+        return self._cache_sheet_properties(spreadsheet_id, json.loads(response.content.decode('utf-8')))
 
-        for sheet in sheets:
-            if sheet['properties']['title'] == worksheet_name:
-                return sheet['properties']['sheetId']
+    def _cache_sheet_properties(self, spreadsheet_id, spreadsheet):
+        sheet_properties = {
+            sheet['properties']['title']: sheet['properties'] for sheet in spreadsheet.get('sheets', [])
+        }
+        self._sheet_properties_cache[spreadsheet_id] = sheet_properties
 
-        raise WorksheetNotFound
+        return sheet_properties
 
     def _spreadsheet_batchupdate_request(self, spreadsheet_id, request_list, include_spreadsheet_in_response=False,
                                          response_include_grid_data=False):
@@ -194,20 +606,31 @@ class GoogleSpreadsheet(object):
             "responseIncludeGridData": response_include_grid_data
         }
 
+        # unless grid data was asked for, only the sheet properties of the updated spreadsheet are needed
+        params = None if response_include_grid_data else {'fields': BATCHUPDATE_RESPONSE_FIELDS}
+
         data = json.dumps(request_body)
 
-        self.logger.debug('sending POST request: {}'.format(req_url))
-        self.logger.debug('request_body: {}'.format(request_body))
+        self.logger.debug('sending POST request: {}; params: {}'.format(req_url, params))
+        # formatted lazily, as the body can hold a whole sheet's worth of cells
+        self.logger.debug('request_body: %s', data)
 
-        response = self.session.post(req_url, data=data)
+        try:
+            response = self.session.post(req_url, data=data, params=params)
+        finally:
+            # the requests may have changed the sheets, so don't trust the cache until it's refreshed below
+            self._sheet_properties_cache.pop(spreadsheet_id, None)
 
         self.logger.debug('response status: {}'.format(response.status_code))
         self.logger.debug('response content: {}'.format(response.content))
 
         if response.ok:
-            return json.loads(response.content.decode('utf-8'))
+            batch_update_response = json.loads(response.content.decode('utf-8'))
+            if 'updatedSpreadsheet' in batch_update_response:
+                self._cache_sheet_properties(spreadsheet_id, batch_update_response['updatedSpreadsheet'])
+            return batch_update_response
         else:
-            raise RequestError
+            raise RequestError(response.status_code, "{0}: {1}".format(response.status_code, response.content))
 
     def delete_worksheet_dimension(self, spreadsheet_id, worksheet_name, dimension, start_index, end_index):
         self.logger.info('deleting {} {} in sheet: {} for spreadsheet_id: {}'.format(end_index - start_index,
@@ -232,7 +655,9 @@ class GoogleSpreadsheet(object):
             'deleteDimension': range
         }
 
-        response = self._spreadsheet_batchupdate_request(spreadsheet_id, [request])
+        # the updated spreadsheet in the response keeps the metadata cache current
+        response = self._spreadsheet_batchupdate_request(spreadsheet_id, [request],
+                                                         include_spreadsheet_in_response=True)
 
         return True
 
@@ -278,7 +703,9 @@ class GoogleSpreadsheet(object):
             'appendDimension': append_dimension_request
         }
 
-        response = self._spreadsheet_batchupdate_request(spreadsheet_id, [request])
+        # the updated spreadsheet in the response keeps the metadata cache current
+        response = self._spreadsheet_batchupdate_request(spreadsheet_id, [request],
+                                                         include_spreadsheet_in_response=True)
 
         return True
 
@@ -305,28 +732,48 @@ class GoogleSpreadsheet(object):
             ))
         ws_rows_current, ws_cols_current = self.get_worksheet_dimensions(spreadsheet_id, worksheet_name)
 
-        if ws_rows_current > num_rows:
-            # delete some rows
-            rows_excess = ws_rows_current - num_rows
-            self.delete_rows_from_bottom_of_worksheet(spreadsheet_id, worksheet_name, rows_excess)
+        if (ws_rows_current, ws_cols_current) != (num_rows, num_columns):
+            # rows and columns are added or removed from the bottom and right in a single request
+            request = self._resize_worksheet_request(self.get_worksheet_id(spreadsheet_id, worksheet_name),
+                                                     num_rows, num_columns)
+            self._spreadsheet_batchupdate_request(spreadsheet_id, [request], include_spreadsheet_in_response=True)
 
-        elif ws_rows_current < num_rows:
-            # add some rows
-            rows_needed = num_rows - ws_rows_current
-            self.append_rows_to_bottom_of_worksheet(spreadsheet_id, worksheet_name, rows_needed)
+        return True
 
-        if ws_cols_current  > num_columns:
-            # delete some cols
-            pass
-            columns_excess = ws_cols_current - num_columns
-            self.delete_columns_from_right_of_worksheet(spreadsheet_id, worksheet_name, columns_excess)
+    def _resize_worksheet_request(self, sheet_id, num_rows, num_columns):
+        return {
+            'updateSheetProperties': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'gridProperties': {
+                        'rowCount': num_rows,
+                        'columnCount': num_columns
+                    }
+                },
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+            }
+        }
 
-        elif ws_cols_current < num_columns:
-            # add some cols
-            columns_needed = num_columns - ws_cols_current
-            self.append_columns_to_right_of_worksheet(spreadsheet_id, worksheet_name, columns_needed)
+    def _update_cells_request(self, sheet_id, start_row_index, start_col_index, end_row_index, end_col_index,
+                              cell_rows=None):
+        """Builds an updateCells request that sets the values of a range, or clears them if cell_rows is None.
 
-        return True
+        Indexes are zero-based and inclusive. Formatting is left alone.
+        """
+        update_cells = {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': start_row_index,
+                'endRowIndex': end_row_index + 1,
+                'startColumnIndex': start_col_index,
+                'endColumnIndex': end_col_index + 1
+            },
+            'fields': 'userEnteredValue'
+        }
+        if cell_rows is not None:
+            update_cells['rows'] = cell_rows
+
+        return {'updateCells': update_cells}
 
     def update_worksheet_range(self, spreadsheet_id, range_a1_notation, rows):
         self.logger.info('sending update_worksheet_range for range: {} in spreadsheet_id: {}'.format(range_a1_notation,
@@ -357,8 +804,194 @@ class GoogleSpreadsheet(object):
         else:
             return False
 
+    def update_worksheet_ranges(self, spreadsheet_id, ranges, payload_budget=UPLOAD_PAYLOAD_BUDGET,
+                                max_concurrent_uploads=1):
+        """Writes values to several ranges using as few values:batchUpdate requests as possible.
+
+        Ranges are packed into requests until a request body would be larger than payload_budget. If the
+        API still rejects a request as too large, the request is split in half and each half is resent.
+        Requests that are rate limited are retried with exponential backoff.
+
+        :param spreadsheet_id: The id of the spreadsheet to update.
+        :param ranges: A list of (range_a1_notation, rows) tuples, where rows is a list of lists of cell values.
+                       The ranges should not overlap.
+        :param payload_budget: The maximum size, in bytes, of a request body.
+        :param max_concurrent_uploads: The most requests to have in flight at once. Concurrency ramps up to
+                                       this from one request, and when requests are rate limited fewer are
+                                       sent at once until they stop being limited. Each upload thread gets
+                                       its own copy of the default HTTPSession; a custom http_session is
+                                       shared between the threads, so it must be thread-safe.
+        :returns: The number of requests that were sent.
+        """
+        self.logger.info('sending update_worksheet_ranges for {} ranges in spreadsheet_id: {}'.format(len(ranges),
+                                                                                                   spreadsheet_id))
+        serialized_value_ranges = []
+        for range_a1_notation, rows in ranges:
+            value_range = {
+                'range': range_a1_notation,
+                'majorDimension': 'ROWS',
+                'values': rows
+            }
+            serialized_value_ranges.extend(self._serialize_value_range(value_range, payload_budget))
+
+        packs = list(_pack_value_ranges(serialized_value_ranges, payload_budget))
+        limiter = _AdaptiveConcurrencyLimiter(max_concurrent_uploads)
+        thread_sessions = local() if max_concurrent_uploads > 1 else None
+
+        # the ranges don't overlap, so the order the requests finish in doesn't matter
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrent_uploads, len(packs)))) as executor:
+            futures = [executor.submit(self._send_value_ranges_with_backoff, spreadsheet_id, pack, limiter,
+                                       thread_sessions)
+                       for pack in packs]
+            try:
+                return sum(future.result() for future in futures)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _get_upload_session(self, thread_sessions=None):
+        """Returns the session the calling upload thread should send its requests with.
+
+        requests.Session isn't thread-safe, so when uploads run concurrently each thread gets its own
+        HTTPSession with the same headers (and so the same authorization). A custom http_session can't be
+        copied, so it is shared.
+
+        :param thread_sessions: A threading.local holding each thread's session, or None to use self.session.
+        """
+        if thread_sessions is None or not isinstance(self.session, HTTPSession):
+            return self.session
+
+        if not hasattr(thread_sessions, 'session'):
+            thread_sessions.session = HTTPSession(headers=dict(self.session.headers))
+
+        return thread_sessions.session
+
+    def _send_value_ranges_with_backoff(self, spreadsheet_id, serialized_value_ranges, limiter,
+                                        thread_sessions=None):
+        """Sends serialized value ranges once the limiter allows it, backing off and retrying if throttled.
+
+        :returns: The number of requests that succeeded.
+        """
+        session = self._get_upload_session(thread_sessions)
+        for attempt in range(MAX_UPLOAD_RETRIES + 1):
+            limiter.acquire()
+            try:
+                request_count = self._send_value_ranges(spreadsheet_id, serialized_value_ranges, session)
+            except RequestError as e:
+                if not _is_rate_limit_error(e) or attempt == MAX_UPLOAD_RETRIES:
+                    limiter.release()
+                    raise
+                limiter.release(throttled=True)
+            else:
+                limiter.release()
+                return request_count
+
+            backoff = min(2 ** attempt + random.random(), MAX_UPLOAD_BACKOFF)
+            self.logger.warning('upload request was rate limited; retrying in {:.1f} seconds'.format(backoff))
+            time.sleep(backoff)
+
+    def _serialize_value_range(self, value_range, payload_budget=UPLOAD_PAYLOAD_BUDGET):
+        """Serializes a value range to JSON, splitting it by rows until each piece fits in payload_budget.
+
+        :returns: A list of (value_range, json_string) tuples.
+        """
+        serialized = json.dumps(value_range)
+        if len(serialized.encode('utf-8')) <= payload_budget or len(value_range['values']) < 2:
+            return [(value_range, serialized)]
+
+        return [
+            serialized_value_range
+            for half in self._split_value_range(value_range)
+            for serialized_value_range in self._serialize_value_range(half, payload_budget)
+        ]
+
+    def _split_value_range(self, value_range):
+        """Splits a ROWS value range in A1 notation (e.g. 'Sheet1'!A1:C1000) into two ranges by rows."""
+        sheet_prefix, cells = value_range['range'].rsplit('!', 1)
+        start_a1, end_a1 = cells.split(':')
+        start_row_index, start_col_index = self._a1_to_rowcol_index(start_a1)
+        end_col_index = self._a1_to_rowcol_index(end_a1)[1]
+
+        rows = value_range['values']
+        middle = len(rows) // 2
+
+        halves = []
+        for row_offset, half_rows in [(0, rows[:middle]), (middle, rows[middle:])]:
+            half_start_a1 = self._rowcol_index_to_a1(start_row_index + row_offset, start_col_index)
+            half_end_a1 = self._rowcol_index_to_a1(start_row_index + row_offset + len(half_rows) - 1, end_col_index)
+            halves.append({
+                'range': '{}!{}:{}'.format(sheet_prefix, half_start_a1, half_end_a1),
+                'majorDimension': value_range['majorDimension'],
+                'values': half_rows
+            })
+
+        return halves
+
+    def _send_value_ranges(self, spreadsheet_id, serialized_value_ranges, session=None):
+        """Sends serialized value ranges in a values:batchUpdate request, splitting it if it's too large.
+
+        :returns: The number of requests that succeeded.
+        """
+        try:
+            self._values_batchupdate_request(spreadsheet_id, [serialized for _, serialized in serialized_value_ranges],
+                                             session)
+            return 1
+        except RequestError as e:
+            if not _is_payload_limit_error(e):
+                raise
+
+            if len(serialized_value_ranges) > 1:
+                middle = len(serialized_value_ranges) // 2
+                halves = [serialized_value_ranges[:middle], serialized_value_ranges[middle:]]
+            elif len(serialized_value_ranges[0][0]['values']) > 1:
+                halves = [
+                    [(half, json.dumps(half))]
+                    for half in self._split_value_range(serialized_value_ranges[0][0])
+                ]
+            else:
+                raise
+
+            self.logger.warning('values:batchUpdate request was too large; retrying in two parts')
+
+            return sum(self._send_value_ranges(spreadsheet_id, half, session) for half in halves)
+
+    def _values_batchupdate_request(self, spreadsheet_id, serialized_value_ranges, session=None):
+        self.logger.info('sending _values_batchupdate_request with {} ranges for spreadsheet_id: {}'.format(
+            len(serialized_value_ranges), spreadsheet_id
+        ))
+
+        req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}/values:batchUpdate".format(spreadsheet_id)
+
+        # the value ranges are already serialized, so the body is assembled around them rather than re-encoded
+        data = VALUES_BATCHUPDATE_ENVELOPE.format(', '.join(serialized_value_ranges))
+
+        self.logger.debug('sending POST request: {}; body size: {}'.format(req_url, len(data)))
+
+        response = (session or self.session).post(req_url, data=data)
+
+        self.logger.debug('response status: {}'.format(response.status_code))
+        self.logger.debug('response content: {}'.format(response.content))
+
+        if response.ok:
+            return json.loads(response.content.decode('utf-8'))
+        else:
+            raise RequestError(response.status_code, "{0}: {1}".format(response.status_code, response.content))
+
     def replace_worksheet_with_dataframe(self, spreadsheet_id, worksheet_name, df, upper_left_cell=None,
-                                         include_header=True):
+                                         include_header=True, payload_budget=UPLOAD_PAYLOAD_BUDGET,
+                                         max_concurrent_uploads=1, upload_engine='values'):
+        """Replaces a range of a worksheet with the contents of a dataframe, resizing the worksheet to fit it.
+
+        upload_engine picks how the data is sent. 'values' (the default) sends JSON arrays of values that are
+        stored exactly as they are. 'paste' sends the frame as comma-delimited text in pasteData requests, which
+        is much smaller for wide numeric frames, but the text is parsed as if it were typed in, so strings that
+        look like numbers or dates (e.g. a student id of '00123') are converted. max_concurrent_uploads only
+        applies to the 'values' engine.
+        """
+        if upload_engine not in UPLOAD_ENGINES:
+            raise ValueError('upload_engine must be one of {}, not {}'.format(UPLOAD_ENGINES, upload_engine))
+
         self.logger.info(
             "replacing sheet: '{}' with dataframe in spreadsheet_id: {} - starting in cell: {}".format(
                 worksheet_name, spreadsheet_id, upper_left_cell
@@ -374,66 +1007,253 @@ class GoogleSpreadsheet(object):
         range_end_row_index = range_start_row_index + df_rows
         range_end_col_index = range_start_col_index + df_cols - 1
 
-        range_end_a1 = self._rowcol_index_to_a1(range_end_row_index, range_end_col_index)
+        values = _dataframe_to_upload_values(df)
+        header = [_to_json_value(column) for column in df.columns] if include_header else None
+
+        # resizing the sheet to fit the range and clearing the range go in one batchUpdate, along with the data
+        # itself if it fits in the payload budget, so viewers never see a half-cleared sheet
+        sheet_id = self.get_worksheet_id(spreadsheet_id, worksheet_name)
+        cell_rows = self._build_cell_rows(values, header, payload_budget) if upload_engine == 'values' else None
+        requests = [
+            self._resize_worksheet_request(sheet_id, range_end_row_index + 1, range_end_col_index + 1),
+            self._update_cells_request(sheet_id, range_start_row_index, range_start_col_index,
+                                       range_end_row_index, range_end_col_index, cell_rows)
+        ]
+
+        if upload_engine == 'paste':
+            # the first pasteData requests go in with the resize and clear, as many as fit
+            paste_requests = [
+                self._paste_data_request(sheet_id, range_start_row_index + row_offset, range_start_col_index, rows)
+                for row_offset, rows in _iter_upload_batches(values, header)
+            ]
+            self._send_batchupdate_requests(spreadsheet_id, requests + paste_requests, payload_budget)
+        else:
+            self._spreadsheet_batchupdate_request(spreadsheet_id, requests, include_spreadsheet_in_response=True)
+        self._forget_sync_manifest_entry(spreadsheet_id, worksheet_name)
+
+        if upload_engine == 'values' and cell_rows is None:
+            # batch the data and upload the batches in as few requests as the payload budget allows
+            batch_ranges = []
+            for row_offset, rows in _iter_upload_batches(values, header):
+                batch_range_start_a1 = self._rowcol_index_to_a1(range_start_row_index + row_offset,
+                                                                range_start_col_index)
+                batch_range_end_a1 = self._rowcol_index_to_a1(range_start_row_index + row_offset + len(rows) - 1,
+                                                              range_end_col_index)
+                batch_range_a1 = "'{}'!{}:{}".format(worksheet_name, batch_range_start_a1, batch_range_end_a1)
+                batch_ranges.append((batch_range_a1, rows))
 
-        range_a1_notation = "'{}'!{}:{}".format(worksheet_name, range_start_a1, range_end_a1)
+            self.update_worksheet_ranges(spreadsheet_id, batch_ranges, payload_budget, max_concurrent_uploads)
 
-        # set sheet dimensions accommodate the range
-        self.set_worksheet_dimensions(spreadsheet_id, worksheet_name, range_end_row_index + 1, range_end_col_index + 1)
+        self.logger.info(
+            "replacing sheet: '{}' with dataframe in spreadsheet_id: {} - starting in cell: {} - COMPLETE".format(
+                worksheet_name, spreadsheet_id, upper_left_cell
+            ))
+        return True
 
-        # clear the range so that no old rows are left over
-        self.clear_worksheet_range(spreadsheet_id, range_a1_notation)
+    def _paste_data_request(self, sheet_id, row_index, col_index, rows):
+        return {
+            'pasteData': {
+                'coordinate': {
+                    'sheetId': sheet_id,
+                    'rowIndex': row_index,
+                    'columnIndex': col_index
+                },
+                'data': _rows_to_delimited_text(rows),
+                'type': 'PASTE_VALUES',
+                'delimiter': ','
+            }
+        }
 
-        # batch the data and upload
-        upload_array = list()
-        index = 0
+    def _send_batchupdate_requests(self, spreadsheet_id, requests, payload_budget=UPLOAD_PAYLOAD_BUDGET):
+        """Sends requests in order, in as few batchUpdate calls as payload_budget allows.
 
-        # add the column headers
-        if include_header:
-            upload_array.append(list(df))
-
-        df_rows_generator = df.iterrows()
-
-        # The '1' is added here to make sure that the else runs for the last batch
-        while index < df_rows + 1:
-            if len(upload_array) < UPLOAD_BATCH_SIZE and (df_rows - index) > 0:
-                rowlist = next(df_rows_generator)[1].tolist()
-                # remove nan values from floats for upload
-                for ix, val in enumerate(rowlist):
-                    if type(val) is not str:
-                        if np.isnan(float(val)):
-                            rowlist[ix] = None
-                upload_array.append(rowlist)
-                index += 1
-
-            # once full or no more rows, write data
-            else:
-                if include_header:
-                    batch_range_start_row_index = range_start_row_index + index - len(upload_array) + 1
-                else:
-                    batch_range_start_row_index = range_start_row_index + index - len(upload_array)
-                batch_range_start_col_index = range_start_col_index
-                batch_range_start_a1 = self._rowcol_index_to_a1(batch_range_start_row_index, batch_range_start_col_index)
-                batch_range_end_row_index = batch_range_start_row_index + len(upload_array)
-                batch_range_end_col_index = range_end_col_index
-                batch_range_end_a1 = self._rowcol_index_to_a1(batch_range_end_row_index, batch_range_end_col_index)
+        :returns: The number of batchUpdate calls that were made.
+        """
+        batchupdate_count = 0
+        pack = []
+        pack_size = 0
+        for request in requests:
+            request_size = len(json.dumps(request)) + 2
+            if pack and pack_size + request_size > payload_budget:
+                self._spreadsheet_batchupdate_request(spreadsheet_id, pack, include_spreadsheet_in_response=True)
+                batchupdate_count += 1
+                pack = []
+                pack_size = 0
+            pack.append(request)
+            pack_size += request_size
+
+        if pack:
+            self._spreadsheet_batchupdate_request(spreadsheet_id, pack, include_spreadsheet_in_response=True)
+            batchupdate_count += 1
+
+        return batchupdate_count
+
+    def _build_cell_rows(self, values, header=None, payload_budget=UPLOAD_PAYLOAD_BUDGET):
+        """Converts rows of cell values to RowData dicts for an updateCells request.
+
+        :returns: A list of RowData dicts, or None if their JSON would be larger than payload_budget.
+        """
+        # every cell takes at least a few bytes ('{}, '), so big frames can be ruled out without converting them
+        if values.size * 4 > payload_budget:
+            return None
+
+        cell_rows = []
+        size = 0
+        rows = values.tolist()
+        if header is not None:
+            rows.insert(0, header)
+        for row in rows:
+            cell_row = {'values': [_to_cell_data(value) for value in row]}
+            size += len(json.dumps(cell_row)) + 2
+            if size > payload_budget:
+                return None
+            cell_rows.append(cell_row)
+
+        return cell_rows
+
+    def sync_worksheet_with_dataframe(self, spreadsheet_id, worksheet_name, df, upper_left_cell=None,
+                                      include_header=True, use_manifest=True, payload_budget=UPLOAD_PAYLOAD_BUDGET,
+                                      max_concurrent_uploads=1):
+        """Updates a worksheet to match a dataframe, only sending the rows that changed.
+
+        Each row (including the header) is hashed and compared with the same row of the worksheet. The
+        worksheet's hashes come from a manifest that is saved to sync_manifest_path after every sync, or, if there
+        is no manifest for the worksheet or use_manifest is False, from the worksheet's current values. Runs of
+        changed rows are then uploaded with update_worksheet_ranges, and the worksheet is resized to fit the
+        dataframe, which removes any rows left over from a longer upload.
+
+        If the worksheet is edited by anything other than this method, pass use_manifest=False so that the diff
+        is taken against what is actually in the worksheet.
+
+        :param spreadsheet_id: The id of the spreadsheet to update.
+        :param worksheet_name: The title of the worksheet to update.
+        :param df: The DataFrame that the worksheet should contain.
+        :param upper_left_cell: The cell in A1 notation where the upper left corner of the data goes. Defaults to A1.
+        :param include_header: Whether the column names should be written above the data.
+        :param use_manifest: Whether to diff against the hashes saved by the last sync, if there are any.
+        :param payload_budget: The maximum size, in bytes, of a request body.
+        :param max_concurrent_uploads: The most upload requests to have in flight at once.
+        :returns: The number of rows (including the header) that were uploaded.
+        """
+        self.logger.info(
+            "syncing sheet: '{}' with dataframe in spreadsheet_id: {} - starting in cell: {}".format(
+                worksheet_name, spreadsheet_id, upper_left_cell
+            ))
+        range_start_a1 = upper_left_cell or 'A1'
+        range_start_row_index, range_start_col_index = self._a1_to_rowcol_index(range_start_a1)
+        range_end_col_index = range_start_col_index + df.shape[1] - 1
 
-                batch_range_a1 = "'{}'!{}:{}".format(worksheet_name, batch_range_start_a1, batch_range_end_a1)
+        values = _dataframe_to_upload_values(df)
+        if include_header:
+            header = np.empty((1, df.shape[1]), dtype=object)
+            header[0, :] = [_to_json_value(column) for column in df.columns]
+            values = np.concatenate([header, values])
+
+        new_hashes = _hash_upload_rows(values)
+
+        manifest_entry = None
+        if use_manifest:
+            manifest_entry = self._get_sync_manifest().get(spreadsheet_id, dict()).get(worksheet_name)
+            if manifest_entry is not None and (manifest_entry['upper_left_cell'] != range_start_a1
+                                               or manifest_entry['num_columns'] != df.shape[1]):
+                manifest_entry = None
+
+        # resize first so that rows and columns beyond the dataframe are removed along with their values
+        range_end_row_index = range_start_row_index + len(values) - 1
+        self.set_worksheet_dimensions(spreadsheet_id, worksheet_name, max(range_end_row_index + 1, 1),
+                                      range_end_col_index + 1)
+
+        if manifest_entry is not None:
+            old_hashes = manifest_entry['row_hashes']
+        else:
+            old_hashes = _hash_upload_rows(self._get_worksheet_values(spreadsheet_id, worksheet_name,
+                                                                      range_start_row_index, range_start_col_index,
+                                                                      range_end_row_index, range_end_col_index))
+
+        changed_ranges = []
+        num_changed_rows = 0
+        for start, stop in _find_changed_row_runs(old_hashes, new_hashes):
+            changed_range_start_a1 = self._rowcol_index_to_a1(range_start_row_index + start, range_start_col_index)
+            changed_range_end_a1 = self._rowcol_index_to_a1(range_start_row_index + stop - 1, range_end_col_index)
+            changed_range_a1 = "'{}'!{}:{}".format(worksheet_name, changed_range_start_a1, changed_range_end_a1)
+            # values:batchUpdate leaves a cell alone when its value is null, so missing values are sent as '' to
+            # clear whatever was in the cell before
+            changed_ranges.append((changed_range_a1, [['' if value is None else value for value in row]
+                                                      for row in values[start:stop].tolist()]))
+            num_changed_rows += stop - start
+
+        self.logger.info('{} of {} rows changed in sheet: {}'.format(num_changed_rows, len(values), worksheet_name))
+
+        if changed_ranges:
+            self.update_worksheet_ranges(spreadsheet_id, changed_ranges, payload_budget, max_concurrent_uploads)
+
+        self._save_sync_manifest_entry(spreadsheet_id, worksheet_name, {
+            'upper_left_cell': range_start_a1,
+            'num_columns': df.shape[1],
+            'row_hashes': new_hashes.tolist()
+        })
+
+        return num_changed_rows
+
+    def _get_worksheet_values(self, spreadsheet_id, worksheet_name, start_row_index, start_col_index,
+                              end_row_index, end_col_index):
+        """Reads the unformatted values of a range into a 2d numpy object array, with empty cells as None.
+
+        Trailing empty rows aren't returned by the API, so the array can have fewer rows than the range.
+        """
+        range_a1_notation = "'{}'!{}:{}".format(worksheet_name,
+                                                self._rowcol_index_to_a1(start_row_index, start_col_index),
+                                                self._rowcol_index_to_a1(end_row_index, end_col_index))
+        req_url = "https://sheets.googleapis.com/v4/spreadsheets/{}/values/{}".format(spreadsheet_id, range_a1_notation)
+        params = {
+            'majorDimension': 'ROWS',
+            'valueRenderOption': 'UNFORMATTED_VALUE'
+        }
 
-                self.update_worksheet_range(spreadsheet_id, batch_range_a1, upload_array)
+        self.logger.debug('sending GET request: {}; params: {}'.format(req_url, params))
 
-                # reset upload_upload array, add current row loop's iteration
-                upload_array = []
+        response = self.session.get(req_url, params=params)
 
-                # stop the loop after the last batch is uploaded
-                if index == df_rows:
-                    break
+        self.logger.debug('response status: {}'.format(response.status_code))
 
-        self.logger.info(
-            "replacing sheet: '{}' with dataframe in spreadsheet_id: {} - starting in cell: {} - COMPLETE".format(
-                worksheet_name, spreadsheet_id, upper_left_cell
-            ))
-        return True
+        rows = json.loads(response.content.decode('utf-8')).get('values', [])
+
+        # the API leaves out trailing empty cells, so pad rows with None, which hashes the same as ''
+        # (see _to_hash_value)
+        values = np.empty((len(rows), end_col_index - start_col_index + 1), dtype=object)
+        for ix, row in enumerate(rows):
+            values[ix, :len(row)] = row
+
+        return values
+
+    def _get_sync_manifest_path(self):
+        return self.sync_manifest_path or os.path.join(gettempdir(), SYNC_MANIFEST_FILENAME)
+
+    def _get_sync_manifest(self):
+        """Loads the row hashes saved by sync_worksheet_with_dataframe, keyed by spreadsheet id then worksheet."""
+        try:
+            with open(self._get_sync_manifest_path()) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def _save_sync_manifest_entry(self, spreadsheet_id, worksheet_name, entry):
+        manifest = self._get_sync_manifest()
+        manifest.setdefault(spreadsheet_id, dict())[worksheet_name] = entry
+        self._save_sync_manifest(manifest)
+
+    def _forget_sync_manifest_entry(self, spreadsheet_id, worksheet_name):
+        """Drops a worksheet's saved hashes, e.g. once it has been rewritten by something other than a sync."""
+        manifest = self._get_sync_manifest()
+        if manifest.get(spreadsheet_id, dict()).pop(worksheet_name, None) is not None:
+            self._save_sync_manifest(manifest)
+
+    def _save_sync_manifest(self, manifest):
+        # write to a new file and swap it in so that a failed write can't leave a corrupt manifest
+        manifest_path = self._get_sync_manifest_path()
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
 
     def _rowcol_index_to_a1(self, row, col):
         """Translates a row and column cell address to A1 notation.
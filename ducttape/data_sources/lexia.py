@@ -10,12 +10,20 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 import pandas as pd
-from tempfile import mkdtemp
+from tempfile import mkdtemp, gettempdir
+from collections import namedtuple
+from contextlib import closing
 import shutil
+import sqlite3
+import hashlib
 import requests
 import json
 import imaplib
+import base64
+import quopri
 import email
+import email.utils
+import os
 import sys
 import datetime as dt
 import re
@@ -27,7 +35,12 @@ from ducttape.webui_datasource import WebUIDataSource
 from ducttape.utils import (
     interpret_report_url,
     wait_for_any_file_in_folder,
+    wait_for_imap_idle_update,
+    parse_imap_list,
+    find_imap_text_plain_part,
     get_most_recent_file_in_dir,
+    read_spreadsheet,
+    requests_session_from_driver,
     DriverBuilder,
     LoggingMixin,
 )
@@ -36,9 +49,117 @@ from ducttape.exceptions import (
     ReportNotFound,
     InvalidIMAPParameters,
     NoDataError,
+    RequestError,
 )
 
+# The encoding Lexia exports are read with, unless an encoding is passed in the read_csv kwargs
 LEXIA_CSV_ENCODING = 'utf-8'
+LEXIA_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# The most pages a paginated Manage tab export endpoint is read for, in case it never returns an empty page
+LEXIA_MANAGE_TAB_EXPORT_MAX_PAGES = 1000
+# Only the headers and the structure of an export email are fetched at first. The structure says which part is
+# the text/plain part with the export link, and only that part is fetched, so attachments and HTML parts are
+# never downloaded.
+LEXIA_EXPORT_EMAIL_FETCH_ITEMS = '(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (DATE SUBJECT)])'
+# The default names of the district export report types, as shown in the myLexia 'District Exports' modal. When
+# several exports are requested at once, an export email that mentions one of these names is matched to that
+# request. Pass district_export_report_names to Lexia if the export emails name the reports differently.
+LEXIA_DISTRICT_EXPORT_REPORT_NAMES = {
+    'export': 'Core5 Monthly',
+    'expytd': 'Core5 Year to Date',
+    'pupytd': 'PowerUp Year to Date',
+    'powerup_detailed': 'PowerUp Detailed Student',
+}
+# How far an export email's Date header may be ahead of our clock and still be matched to a request.
+LEXIA_EXPORT_EMAIL_CLOCK_SKEW = dt.timedelta(minutes=5)
+LEXIA_EXPORT_LEDGER_FILENAME = 'lexia_district_export_ledger.sqlite'
+
+# A district export that has been requested from Lexia
+DistrictExportRequest = namedtuple('DistrictExportRequest', [
+    'submitted_at', 'district_id', 'report_type', 'period_start_date', 'period_end_date'
+])
+
+
+def _csv_file_has_data_rows(file_path):
+    """Whether a CSV file has at least one non-blank line after its header, without parsing it."""
+    with open(file_path, 'rb') as f:
+        f.readline()
+        return any(line.strip() for line in f)
+
+
+class LexiaExportLedger(object):
+    """ A local SQLite record of the Lexia district export_ids that have been downloaded.
+
+    Lexia only serves an export once, so an export_id that is in the ledger never needs to
+    be tried again. An entry can also point to a local copy of the export, so that the same
+    export requested again on the same day can be read from disk instead of regenerated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__execute(
+            'CREATE TABLE IF NOT EXISTS consumed_exports ('
+            'export_id INTEGER PRIMARY KEY, district_id TEXT, report_type TEXT, period_start_date TEXT, '
+            'period_end_date TEXT, consumed_on TEXT, file_path TEXT)'
+        )
+
+    def __execute(self, sql, parameters=()):
+        with closing(sqlite3.connect(self.path)) as conn:
+            with conn:
+                return conn.execute(sql, parameters).fetchall()
+
+    def is_consumed(self, export_id):
+        """Whether an export_id has already been downloaded."""
+        return bool(self.__execute('SELECT 1 FROM consumed_exports WHERE export_id = ?', (export_id,)))
+
+    def record(self, export_id, request=None, file_path=None):
+        """Records that an export_id has been downloaded.
+
+        Args:
+            export_id (int): The Lexia export id.
+            request (DistrictExportRequest): The request the export belongs to, if known.
+            file_path (str): The path of a local copy of the export, if one was kept.
+        """
+        today = dt.date.today().isoformat()
+        if request is None:
+            request = DistrictExportRequest(None, None, None, None, None)
+        self.__execute(
+            'INSERT OR REPLACE INTO consumed_exports VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (export_id, self.__to_text(request.district_id), request.report_type,
+             self.__to_text(request.period_start_date), self.__to_text(request.period_end_date), today, file_path)
+        )
+        self.remove_stale_local_copies()
+
+    def find_local_copy(self, request):
+        """Returns the path of a local copy of an export for the same district, report type and period
+        that was downloaded today, or None if there isn't one."""
+        rows = self.__execute(
+            'SELECT file_path FROM consumed_exports WHERE district_id = ? AND report_type = ? '
+            'AND period_start_date = ? AND period_end_date = ? AND consumed_on = ? AND file_path IS NOT NULL '
+            'ORDER BY export_id DESC',
+            (self.__to_text(request.district_id), request.report_type, self.__to_text(request.period_start_date),
+             self.__to_text(request.period_end_date), dt.date.today().isoformat())
+        )
+        for (file_path,) in rows:
+            if os.path.isfile(file_path):
+                return file_path
+
+        return None
+
+    def remove_stale_local_copies(self):
+        """Deletes the local copies of exports that were downloaded before today."""
+        today = dt.date.today().isoformat()
+        rows = self.__execute(
+            'SELECT file_path FROM consumed_exports WHERE consumed_on != ? AND file_path IS NOT NULL', (today,)
+        )
+        for (file_path,) in rows:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        self.__execute('UPDATE consumed_exports SET file_path = NULL WHERE consumed_on != ?', (today,))
+
+    @staticmethod
+    def __to_text(value):
+        return None if value is None else str(value)
 
 
 class Lexia(WebUIDataSource, LoggingMixin):
@@ -49,7 +170,10 @@ class Lexia(WebUIDataSource, LoggingMixin):
                  lexia_school_year_start_date=None,
                  district_export_email_address=None, district_export_email_password=None,
                  district_export_email_imap_uri=None, district_export_email_folder='Lexia District Exports',
-                 district_export_email_wait_time=600, district_export_email_retry_frequency=30, district_id=None):
+                 district_export_email_wait_time=600, district_export_email_retry_frequency=30, district_id=None,
+                 district_export_email_sender=None, district_export_email_subject=None,
+                 district_export_ledger_path=None, district_export_reuse_same_day=False,
+                 district_export_report_names=None, district_export_email_use_idle=False):
         super().__init__(username, password, wait_time, hostname, temp_folder_path, headless)
         self.lexia_school_year_start_date = lexia_school_year_start_date
         self.district_export_email_address = district_export_email_address
@@ -59,6 +183,22 @@ class Lexia(WebUIDataSource, LoggingMixin):
         self.district_export_email_wait_time = district_export_email_wait_time
         self.district_export_email_retry_frequency = district_export_email_retry_frequency
         self.district_id = district_id
+        # optional IMAP SEARCH filters for the export emails, matched as substrings by the server
+        self.district_export_email_sender = district_export_email_sender
+        self.district_export_email_subject = district_export_email_subject
+        # the ledger of downloaded export_ids defaults to a file in the temp folder
+        self.district_export_ledger_path = district_export_ledger_path
+        # serve a district export that was already downloaded today from its local copy
+        self.district_export_reuse_same_day = district_export_reuse_same_day
+        # the names export emails use for each report type, to tell apart exports requested at the same time
+        self.district_export_report_names = district_export_report_names or LEXIA_DISTRICT_EXPORT_REPORT_NAMES
+        # wait for export emails with IMAP IDLE (see wait_for_imap_idle_update) instead of polling
+        self.district_export_email_use_idle = district_export_email_use_idle
+        self.__export_ledger = None
+        # state of the incremental scan of the export email folder
+        self.__export_email_uidvalidity = None
+        self.__last_export_email_uid = 0
+        self.__highest_export_id = -1
         self.uri_scheme = 'https://'
         self.base_url = self.uri_scheme + 'www.' + self.hostname
 
@@ -100,7 +240,8 @@ class Lexia(WebUIDataSource, LoggingMixin):
                 downloaded file. If nothing is provided, the file will be
                 stored in a temporary directory and deleted at the end of
                 this function.
-            **kwargs: additional arguments to pass to Pandas read_excel or
+            **kwargs: additional arguments to pass to ducttape.utils.read_spreadsheet
+                (sheet_name, header, usecols, dtype, or any Pandas read_excel argument) or
                 read_csv (depending on the report_url)
 
         Returns: A Pandas DataFrame of the report contents.
@@ -133,8 +274,7 @@ class Lexia(WebUIDataSource, LoggingMixin):
         wait_for_any_file_in_folder(csv_download_folder_path, "xlsx")
         self.log.info('Download Finished.')
 
-        df_report = pd.read_excel(get_most_recent_file_in_dir(csv_download_folder_path),
-                                **kwargs)
+        df_report = read_spreadsheet(get_most_recent_file_in_dir(csv_download_folder_path), **kwargs)
 
         # if the dataframe is empty (the report had no data), raise an error
         if df_report.shape[0] == 0:
@@ -148,9 +288,16 @@ class Lexia(WebUIDataSource, LoggingMixin):
 
         return df_report
 
-    def download_manage_tab_report(self, report_url, write_to_disk=None, **kwargs):
+    def download_manage_tab_report(self, report_url, write_to_disk=None, export_api_url=None,
+                                   export_api_page_param=None, **kwargs):
         """ Downloads a Lexia report from the 'Manage' tab.
 
+        By default this drives the Manage tab in the browser: it selects all
+        rows, clicks Export and waits for the downloaded file. If
+        export_api_url is given, the browser is only used to log in and the
+        export is requested directly from that endpoint, which skips
+        rendering the (potentially very large) group in the browser.
+
         Args:
             report_url (string): Information pertaining to the path and query
                 string for the report whose access is desired. Any filtering
@@ -159,10 +306,23 @@ class Lexia(WebUIDataSource, LoggingMixin):
                 downloaded file. If nothing is provided, the file will be
                 stored in a temporary directory and deleted at the end of
                 this function.
+            export_api_url (string): The path and query string of the request
+                the Manage tab's Export button makes (as seen in the browser's
+                network tab). It may return tab separated text or JSON.
+            export_api_page_param (string): The name of the query string
+                parameter that pages through export_api_url, if it is paginated.
+                Pages are requested from 1 until an empty page is returned. A
+                ValueError is raised if a page repeats the one before it (the
+                endpoint is ignoring the parameter) or if there are more than
+                LEXIA_MANAGE_TAB_EXPORT_MAX_PAGES pages.
             **kwargs: additional arguments to pass to Pandas read_csv
 
         Returns: A Pandas DataFrame of the report contents.
         """
+        if export_api_url:
+            return self.__download_manage_tab_report_over_http(report_url, export_api_url, write_to_disk,
+                                                               export_api_page_param, **kwargs)
+
         if write_to_disk:
             csv_download_folder_path = write_to_disk
         else:
@@ -214,81 +374,515 @@ class Lexia(WebUIDataSource, LoggingMixin):
 
         return df_report
 
+    def __download_manage_tab_report_over_http(self, report_url, export_api_url, write_to_disk=None,
+                                               export_api_page_param=None, **kwargs):
+        """ Downloads a Lexia 'Manage' tab report by calling its export endpoint through the browser's login.
+
+        Args:
+            report_url (string): The Manage tab report the export belongs to (used for messages).
+            export_api_url (string): The path and query string of the export endpoint.
+            write_to_disk (string): The path for a directory to store the downloaded pages in.
+            export_api_page_param (string): The query string parameter that pages through the export.
+            **kwargs: additional arguments to pass to Pandas read_csv
+
+        Returns: A Pandas DataFrame of the report contents.
+        """
+        self.driver = DriverBuilder().get_driver(headless=self.headless)
+        self._login()
+
+        export_download_url = interpret_report_url(self.base_url, export_api_url)
+        dfs = []
+        try:
+            with requests_session_from_driver(self.driver) as s:
+                page = 1
+                while True:
+                    params = {export_api_page_param: page} if export_api_page_param else None
+                    self.log.info('Getting export at: {} (params: {})'.format(export_download_url, params))
+                    response = s.get(export_download_url, params=params, stream=True)
+                    response.raise_for_status()
+
+                    df_page = self.__read_manage_tab_export_response(response, write_to_disk, page, **kwargs)
+                    if dfs and df_page.shape[0] > 0 and df_page.equals(dfs[-1]):
+                        raise ValueError('Page {} of the export at {} is the same as page {}. Check that {} is '
+                                         'the parameter that pages through it.'.format(
+                                             page, export_download_url, page - 1, export_api_page_param))
+                    dfs.append(df_page)
+                    if not export_api_page_param or df_page.shape[0] == 0:
+                        break
+                    if page >= LEXIA_MANAGE_TAB_EXPORT_MAX_PAGES:
+                        raise ValueError('The export at {} did not return an empty page within {} pages.'.format(
+                            export_download_url, LEXIA_MANAGE_TAB_EXPORT_MAX_PAGES))
+                    page += 1
+        finally:
+            self.driver.close()
+
+        df_report = pd.concat(dfs, ignore_index=True)
+
+        # if the dataframe is empty (the report had no data), raise an error
+        if df_report.shape[0] == 0:
+            raise ValueError('No data in report for user {} at url: {}'.format(
+                self.username, interpret_report_url(self.base_url, report_url)))
+
+        return df_report
+
+    def __read_manage_tab_export_response(self, response, write_to_disk=None, page=1, **kwargs):
+        """ Parses one streamed response from a Manage tab export endpoint.
+
+        Tab separated responses are streamed straight into Pandas read_csv; JSON responses are
+        flattened with Pandas json_normalize. If write_to_disk is given, the response is first
+        streamed to a file in that directory and parsed from there.
+        """
+        is_json = 'json' in response.headers.get('Content-Type', '')
+        if write_to_disk:
+            file_path = os.path.join(write_to_disk, 'manage_tab_export_{}.{}'.format(page, 'json' if is_json else 'tsv'))
+            with open(file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=LEXIA_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            source = open(file_path, 'rb')
+        else:
+            # let urllib3 undo any gzip/deflate encoding while Pandas reads the stream
+            response.raw.decode_content = True
+            source = response.raw
+
+        with source:
+            if is_json:
+                records = json.load(source)
+                if isinstance(records, dict):
+                    # the rows are the (first) list in the response object
+                    records = next((value for value in records.values() if isinstance(value, list)), [])
+                return pd.json_normalize(records)
+            else:
+                return pd.read_csv(source, sep='\t', **dict({'encoding': LEXIA_CSV_ENCODING}, **kwargs))
+
     def download_district_export_core5_monthly(self, write_to_disk=None, pandas_read_csv_kwargs={},
-                                               period_end_date=dt.datetime.now().date()):
+                                               period_end_date=dt.datetime.now().date(),
+                                               return_dataframe=True, hash_algorithm=None):
         return self._download_district_export(
             report_type='export',
             period_end_date=period_end_date,
             write_to_disk=write_to_disk,
-            pandas_read_csv_kwargs=pandas_read_csv_kwargs
+            pandas_read_csv_kwargs=pandas_read_csv_kwargs,
+            return_dataframe=return_dataframe,
+            hash_algorithm=hash_algorithm
         )
 
     def download_district_export_core5_year_to_date(self, write_to_disk=None, pandas_read_csv_kwargs={},
-                                                    period_end_date=dt.datetime.now().date()):
+                                                    period_end_date=dt.datetime.now().date(),
+                                                    return_dataframe=True, hash_algorithm=None):
         return self._download_district_export(
             report_type='expytd',
             period_end_date=period_end_date,
             write_to_disk=write_to_disk,
-            pandas_read_csv_kwargs=pandas_read_csv_kwargs
+            pandas_read_csv_kwargs=pandas_read_csv_kwargs,
+            return_dataframe=return_dataframe,
+            hash_algorithm=hash_algorithm
         )
 
     def download_district_export_powerup_year_to_date(self, write_to_disk=None, pandas_read_csv_kwargs={},
-                                                      period_end_date=dt.datetime.now().date()):
+                                                      period_end_date=dt.datetime.now().date(),
+                                                      return_dataframe=True, hash_algorithm=None):
         return self._download_district_export(
             report_type='pupytd',
             period_end_date=period_end_date,
             write_to_disk=write_to_disk,
-            pandas_read_csv_kwargs=pandas_read_csv_kwargs
+            pandas_read_csv_kwargs=pandas_read_csv_kwargs,
+            return_dataframe=return_dataframe,
+            hash_algorithm=hash_algorithm
         )
     
     def download_district_export_powerup_detailed_student(self, write_to_disk=None, pandas_read_csv_kwargs={},
-                                                      period_end_date=dt.datetime.now().date()):
+                                                      period_end_date=dt.datetime.now().date(),
+                                                      return_dataframe=True, hash_algorithm=None):
         return self._download_district_export(
             report_type='powerup_detailed',
             period_end_date=period_end_date,
             write_to_disk=write_to_disk,
-            pandas_read_csv_kwargs=pandas_read_csv_kwargs
+            pandas_read_csv_kwargs=pandas_read_csv_kwargs,
+            return_dataframe=return_dataframe,
+            hash_algorithm=hash_algorithm
         )
 
+    def download_district_exports(self, report_types, district_ids=None, write_to_disk=None,
+                                  pandas_read_csv_kwargs={}, period_end_date=None, period_start_date=None,
+                                  return_dataframe=True, hash_algorithm=None):
+        """Requests several district exports from one Lexia session and downloads each one as its email arrives.
+
+        All of the exports are requested up front, for every district, so the total wait is roughly that of
+        the slowest export rather than the sum of all of them. Each export email is matched to a request by the
+        report name (see district_export_report_names) and district id in the email. An email that can't be
+        matched to a single kind of export is left unmatched rather than guessed at. If an export request fails,
+        the exports that were already requested are still downloaded before a RequestError is raised.
+
+        Args:
+            report_types (list): The Lexia report types to export (the keys of district_export_report_names,
+                e.g. ['export', 'expytd'])
+            district_ids (list): The Lexia district ids to export for. The login must have access to all of them.
+                Defaults to the district_id this object was created with.
+            write_to_disk (str): A directory where each downloaded CSV should be written to disk as
+                <district_id>_<report_type>.csv
+            pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            period_end_date (datetime.date): The end date for the export requests. Defaults to today.
+            period_start_date (datetime.date): The start date for the export requests. Defaults to
+                lexia_school_year_start_date.
+            return_dataframe (bool): Whether to parse the exports. If False, write_to_disk is required and the
+                exports are only written to disk, as Lexia sent them.
+            hash_algorithm (str): A hashlib algorithm name (e.g. 'sha256'). If given, a digest of each export is
+                written next to it as <district_id>_<report_type>.csv.<hash_algorithm>
+        Returns:
+            dict: A Pandas DataFrame of each export (or its path if return_dataframe is False), keyed by report
+                type. If district_ids is passed, a dict of those dicts keyed by district id.
+        """
+        if not return_dataframe and not write_to_disk:
+            raise ValueError('write_to_disk is required when return_dataframe is False.')
+        if not period_start_date:
+            period_start_date = self.lexia_school_year_start_date
+        if not period_end_date:
+            period_end_date = dt.datetime.now().date()
+
+        dfs = dict()
+        requests_to_submit = []
+        for district_id in (district_ids or [self.district_id]):
+            for report_type in report_types:
+                request = DistrictExportRequest(None, district_id, report_type, period_start_date, period_end_date)
+                df_report = self.__load_same_day_export(
+                    request, self.__get_batch_export_path(write_to_disk, request), pandas_read_csv_kwargs,
+                    return_dataframe
+                )
+                if df_report is None:
+                    requests_to_submit.append(request)
+                else:
+                    dfs.setdefault(district_id, dict())[report_type] = df_report
+
+        if requests_to_submit:
+            session = self.__login_for_district_exports()
+            try:
+                imap_conn = self.__connect_to_export_mailbox()
+                try:
+                    # anything already in the folder belongs to an earlier request
+                    self.__fetch_new_export_emails(imap_conn)
+
+                    pending_requests = []
+                    failed_request = None
+                    for request in requests_to_submit:
+                        request = request._replace(submitted_at=dt.datetime.now(dt.timezone.utc))
+                        was_request_successful = self.__submit_district_export(
+                            session, request.report_type, period_start_date, period_end_date, request.district_id
+                        )
+                        if not was_request_successful:
+                            failed_request = request
+                            break
+                        pending_requests.append(request)
+
+                    # exports that were requested are downloaded even if a later request failed, so that they are
+                    # recorded in the ledger rather than left in the email folder
+                    dfs_downloaded = self.__collect_district_exports(imap_conn, session, pending_requests,
+                                                                     write_to_disk, pandas_read_csv_kwargs,
+                                                                     return_dataframe, hash_algorithm)
+                    if failed_request is not None:
+                        raise RequestError('Export request for {} failed for district {}.'.format(
+                            failed_request.report_type, failed_request.district_id
+                        ))
+                finally:
+                    self.__disconnect_from_export_mailbox(imap_conn)
+            finally:
+                session.close()
+                self.driver.close()
+
+            for district_id, district_dfs in dfs_downloaded.items():
+                dfs.setdefault(district_id, dict()).update(district_dfs)
+
+        if district_ids:
+            return dfs
+        else:
+            return dfs[self.district_id]
+
+    def __collect_district_exports(self, imap_conn, session, pending_requests, write_to_disk=None,
+                                   pandas_read_csv_kwargs={}, return_dataframe=True, hash_algorithm=None):
+        """Matches new export emails to pending export requests and downloads them until none are left.
+
+        Args:
+            imap_conn (imaplib.IMAP4_SSL): A connection with the export email folder selected.
+            session (requests.Session): A session logged into Lexia.
+            pending_requests (list): DistrictExportRequests in the order they were requested.
+            write_to_disk (str): A directory where each downloaded CSV should be written to disk.
+            pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            return_dataframe (bool): Whether to parse the exports (see __download_export_for_exportid).
+            hash_algorithm (str): A hashlib algorithm to digest the exports with (see __download_export_for_exportid).
+        Returns:
+            dict: A dict of Pandas DataFrames keyed by report type for each district, keyed by district id.
+        """
+        pending_requests = list(pending_requests)
+        dfs = dict()
+        deadline = time.time() + self.district_export_email_wait_time
+        while pending_requests:
+            cursor_can_advance = True
+            for uid, msg, export_ids in self.__fetch_new_export_emails(imap_conn, advance_cursor=False):
+                email_consumed = True
+                for export_id in export_ids:
+                    if self.__get_export_ledger().is_consumed(export_id):
+                        self.log.info('export_id {} has already been downloaded, skipping it.'.format(export_id))
+                        continue
+
+                    match = self.__match_export_email_to_request(msg, pending_requests,
+                                                                 self.district_export_report_names)
+                    if match is None:
+                        self.log.warning('export_id {} does not match any pending export request.'.format(export_id))
+                        email_consumed = False
+                        continue
+
+                    self.log.info('{}: export_id {} matched to {} export.'.format(
+                        match.district_id, export_id, match.report_type
+                    ))
+                    try:
+                        dfs.setdefault(match.district_id, dict())[match.report_type] = self.__download_district_export(
+                            export_id, match, self.__get_batch_export_path(write_to_disk, match),
+                            pandas_read_csv_kwargs, session, return_dataframe, hash_algorithm
+                        )
+                        pending_requests.remove(match)
+                    except NoDataError as e:
+                        self.log.warning('{}: {}'.format(match.district_id, e))
+                        email_consumed = False
+
+                # only move the cursor past emails whose exports have all been downloaded, so that the others
+                # are fetched and matched again on the next poll
+                cursor_can_advance = cursor_can_advance and email_consumed
+                if cursor_can_advance:
+                    self.__last_export_email_uid = uid
+
+            if not pending_requests:
+                break
+
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                raise ReportNotFound(
+                    'No email was received with report id for {}. Make sure the emails are not going to spam.'.format(
+                        ', '.join('{} ({})'.format(request.report_type, request.district_id)
+                                  for request in pending_requests)
+                    ))
+            self.__wait_for_export_email(imap_conn, min(self.district_export_email_retry_frequency, remaining_time))
+
+        return dfs
+
+    @staticmethod
+    def __get_batch_export_path(write_to_disk, request):
+        """The path a batch-downloaded export is written to, or None if it isn't written to disk."""
+        if write_to_disk:
+            return os.path.join(write_to_disk, '{}_{}.csv'.format(request.district_id, request.report_type))
+        else:
+            return None
+
+    @staticmethod
+    def __match_export_email_to_request(msg, pending_requests, report_names=LEXIA_DISTRICT_EXPORT_REPORT_NAMES):
+        """Picks the pending export request that an export email most likely belongs to.
+
+        Requests made after the email was sent are ruled out using its Date header. Of the rest, requests whose
+        report name and then whose district id appear in the email are preferred. The email is only matched if
+        that leaves requests for one report type and district, which are interchangeable, so the oldest of them
+        is returned. So when a single request is pending, an email that names no report is still matched to it.
+
+        Args:
+            msg (email.message.Message): The export email.
+            pending_requests (list): DistrictExportRequests in the order they were requested.
+            report_names (dict): The name of each report type in the export emails.
+        Returns:
+            The matching DistrictExportRequest, or None if the email can't be matched to a single kind of export.
+        """
+        candidates = pending_requests
+        try:
+            sent_at = email.utils.parsedate_to_datetime(msg['Date'])
+        except (TypeError, ValueError):
+            sent_at = None
+        if sent_at is not None and sent_at.tzinfo is not None:
+            candidates = [request for request in candidates
+                          if request.submitted_at <= sent_at + LEXIA_EXPORT_EMAIL_CLOCK_SKEW]
+        if not candidates:
+            return None
+
+        email_text = ' '.join([str(msg['Subject'] or '')] + [
+            part.get_payload() for part in msg.walk() if part.get_content_type() == 'text/plain'
+        ]).lower()
+        named_candidates = [
+            request for request in candidates
+            if report_names.get(request.report_type, request.report_type).lower() in email_text
+        ]
+        candidates = named_candidates or candidates
+        district_candidates = [
+            request for request in candidates
+            if re.search(r'(?<!\d){}(?!\d)'.format(request.district_id), email_text)
+        ]
+        candidates = district_candidates or candidates
+        if len({(request.report_type, request.district_id) for request in candidates}) != 1:
+            return None
+
+        return candidates[0]
+
     def _download_district_export(self, report_type, period_end_date, period_start_date=None,
-                                  write_to_disk=None, pandas_read_csv_kwargs={}):
+                                  write_to_disk=None, pandas_read_csv_kwargs={}, return_dataframe=True,
+                                  hash_algorithm=None):
+        # check before requesting the export, rather than once it has been generated
+        if not return_dataframe and not write_to_disk:
+            raise ValueError('write_to_disk is required when return_dataframe is False.')
         if not period_start_date:
             period_start_date = self.lexia_school_year_start_date
+        request = DistrictExportRequest(None, self.district_id, report_type, period_start_date, period_end_date)
+        df_report = self.__load_same_day_export(request, write_to_disk, pandas_read_csv_kwargs, return_dataframe)
+        if df_report is not None:
+            return df_report
+
+        request = request._replace(submitted_at=dt.datetime.now(dt.timezone.utc))
         was_request_successful = self.__request_district_export(report_type, period_start_date, period_end_date)
         assert was_request_successful, 'Export request failed.'
 
-        df_report = None
-        number_retries = int(self.district_export_email_wait_time / self.district_export_email_retry_frequency)
-        for retry_count in range(0, number_retries):
-            if retry_count > 0:
-                time.sleep(self.district_export_email_retry_frequency)
+        # hold a single authenticated mailbox connection for the whole wait rather than logging in on every poll
+        imap_conn = self.__connect_to_export_mailbox()
+        try:
+            df_report = self.__wait_for_district_export(imap_conn, request, write_to_disk, pandas_read_csv_kwargs,
+                                                        return_dataframe, hash_algorithm)
+        finally:
+            self.__disconnect_from_export_mailbox(imap_conn)
+
+        if df_report is None:
+            raise ReportNotFound('No email was received with report id. Make sure the emails are not going to spam.')
+        else:
+            return df_report
+
+    def __wait_for_district_export(self, imap_conn, request, write_to_disk=None, pandas_read_csv_kwargs={},
+                                   return_dataframe=True, hash_algorithm=None):
+        """Waits for the export email to arrive and downloads the export it points to.
+
+        Args:
+            imap_conn (imaplib.IMAP4_SSL): A connection with the export email folder selected.
+            request (DistrictExportRequest): The export that was requested.
+            write_to_disk (str): A path where the CSV that has been downloaded should be written to disk.
+            pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            return_dataframe (bool): Whether to parse the export (see __download_export_for_exportid).
+            hash_algorithm (str): A hashlib algorithm to digest the export with (see __download_export_for_exportid).
+        Returns:
+            A Pandas dataframe with the report contents (or the write_to_disk path if return_dataframe is False),
+            or None if the email wait time ran out.
+        """
+        deadline = time.time() + self.district_export_email_wait_time
+        retry_count = 0
+        while True:
             self.log.info(str(self.district_id) + ': get export_id from email, try: ' + str(retry_count))
             try:
-                export_id = self.__get_exportid_from_email()
+                export_id = self.__get_exportid_from_email(imap_conn)
             except ValueError as err:
                 self.log.debug(err)
-                self.log.warning('{}: No export_id found in email, retrying in {} seconds.'.format(
-                    self.district_id,
-                    self.district_export_email_retry_frequency
-                ))
-                time.sleep(self.district_export_email_retry_frequency)
-                continue
+                self.log.warning('{}: No export_id found in email.'.format(self.district_id))
+                export_id = None
 
-            try:
-                # Note: If the most recent exportid in the email folder is from a previously requested export,
-                #    then this download will fail on the Lexia side, and the function will try again after a wait.
-                df_report = self.__download_export_for_exportid(export_id, write_to_disk, pandas_read_csv_kwargs)
-                break
-            except NoDataError as e:
-                self.log.warning('{}: {} Retrying in {} seconds.'.format(
-                    self.district_id,
-                    e,
-                    self.district_export_email_retry_frequency
+            if export_id is not None and self.__get_export_ledger().is_consumed(export_id):
+                self.log.info('{}: export_id {} has already been downloaded, waiting for a new one.'.format(
+                    self.district_id, export_id
                 ))
-        if df_report is None:
-            raise ReportNotFound('No email was received with report id. Make sure the emails are not going to spam.')
+            elif export_id is not None:
+                try:
+                    # Note: If the most recent exportid in the email folder is from a previously requested export
+                    #    that isn't in the ledger, then this download will fail on the Lexia side, and the function
+                    #    will try again on the next poll, with the export_id of a new email once one arrives.
+                    return self.__download_district_export(export_id, request, write_to_disk, pandas_read_csv_kwargs,
+                                                           return_dataframe=return_dataframe,
+                                                           hash_algorithm=hash_algorithm)
+                except NoDataError as e:
+                    self.log.warning('{}: {}'.format(self.district_id, e))
+
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                return None
+            self.__wait_for_export_email(imap_conn, min(self.district_export_email_retry_frequency, remaining_time))
+            retry_count += 1
+
+    def __get_export_ledger(self):
+        """Returns the LexiaExportLedger of export_ids that have been downloaded, opening it on first use."""
+        if self.__export_ledger is None:
+            ledger_path = self.district_export_ledger_path or os.path.join(
+                getattr(self, 'temp_folder_path', None) or gettempdir(), LEXIA_EXPORT_LEDGER_FILENAME
+            )
+            self.__export_ledger = LexiaExportLedger(ledger_path)
+
+        return self.__export_ledger
+
+    def __download_district_export(self, export_id, request, write_to_disk=None, pandas_read_csv_kwargs={},
+                                   session=None, return_dataframe=True, hash_algorithm=None):
+        """Downloads the export for an export_id and records it in the export ledger.
+
+        Args:
+            export_id (int): The Lexia export id to download.
+            request (DistrictExportRequest): The export request the export_id belongs to.
+            write_to_disk (str): A path where the CSV that has been downloaded should be written to disk.
+            pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            session (requests.Session): A session logged into Lexia (see __download_export_for_exportid).
+            return_dataframe (bool): Whether to parse the export (see __download_export_for_exportid).
+            hash_algorithm (str): A hashlib algorithm to digest the export with (see __download_export_for_exportid).
+        Returns:
+            A Pandas dataframe with the report contents, or the write_to_disk path if return_dataframe is False
+        """
+        ledger = self.__get_export_ledger()
+        if self.district_export_reuse_same_day:
+            local_copy_path = os.path.join(os.path.dirname(os.path.abspath(ledger.path)),
+                                           'lexia_export_{}.csv'.format(export_id))
         else:
-            return df_report
+            local_copy_path = None
+
+        # an export that comes back empty raises NoDataError and isn't recorded, so that it is tried again
+        df_report = self.__download_export_for_exportid(export_id, write_to_disk, pandas_read_csv_kwargs,
+                                                        session, local_copy_path, return_dataframe, hash_algorithm)
+
+        ledger.record(export_id, request, local_copy_path)
+
+        return df_report
+
+    def __load_same_day_export(self, request, write_to_disk=None, pandas_read_csv_kwargs={}, return_dataframe=True):
+        """Reads an export that was already downloaded today from its local copy.
+
+        Args:
+            request (DistrictExportRequest): The export to look for.
+            write_to_disk (str): A path where the CSV should be copied to.
+            pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            return_dataframe (bool): Whether to parse the export. If False, it is only copied to write_to_disk.
+        Returns:
+            A Pandas dataframe with the report contents (or the write_to_disk path if return_dataframe is False),
+            or None if reuse is turned off or there is no copy.
+        """
+        if not self.district_export_reuse_same_day:
+            return None
+
+        file_path = self.__get_export_ledger().find_local_copy(request)
+        if file_path is None:
+            return None
+
+        self.log.info('{}: Using {} export downloaded earlier today from: {}'.format(
+            request.district_id, request.report_type, file_path
+        ))
+        if write_to_disk:
+            shutil.copyfile(file_path, write_to_disk)
+
+        if return_dataframe:
+            return pd.read_csv(file_path, **dict({'encoding': LEXIA_CSV_ENCODING}, **pandas_read_csv_kwargs))
+        else:
+            return write_to_disk
+
+    def __wait_for_export_email(self, imap_conn, timeout):
+        """Waits until a new message arrives in the export email folder or the timeout elapses.
+
+        By default this sleeps for the timeout. If district_export_email_use_idle is set and the server
+        supports it, IMAP IDLE is used instead, so that we wake up as soon as Lexia's email lands. The timeout
+        still bounds IDLE so that a message that arrived between the last search and the start of IDLE is
+        picked up on the next try.
+        """
+        if self.district_export_email_use_idle and 'IDLE' in imap_conn.capabilities:
+            self.log.info('{}: Waiting up to {:.0f} seconds for a new export email.'.format(
+                self.district_id, timeout
+            ))
+            wait_for_imap_idle_update(imap_conn, timeout)
+        else:
+            self.log.info('{}: Checking for a new export email again in {:.0f} seconds.'.format(
+                self.district_id, timeout
+            ))
+            time.sleep(timeout)
+            # let the server report any messages that arrived while we slept
+            imap_conn.noop()
 
     def __request_district_export(self, report_type, period_start_date=None, period_end_date=None,
                                   write_to_disk=None):
@@ -304,50 +898,70 @@ class Lexia(WebUIDataSource, LoggingMixin):
         :param write_to_disk: The path to save the CSV to.
         :return: Boolean. Whether or not the export request was successful.
         """
+        with self.__login_for_district_exports(write_to_disk) as s:
+            return self.__submit_district_export(s, report_type, period_start_date, period_end_date)
+
+    def __login_for_district_exports(self, write_to_disk=None):
+        """
+        Logs into Lexia with a new driver and hands the login over to a requests session.
+        :param write_to_disk: The path the driver should download files to.
+        :return: A requests.Session carrying the driver's cookies.
+        """
         if write_to_disk:
             csv_download_folder_path = write_to_disk
         else:
-            csv_download_folder_path = self.temp_folder_path
+            csv_download_folder_path = getattr(self, 'temp_folder_path', None)
         self.driver = DriverBuilder().get_driver(csv_download_folder_path, self.headless)
         self._login()
 
+        return requests_session_from_driver(self.driver)
+
+    def __submit_district_export(self, session, report_type, period_start_date, period_end_date,
+                                 district_id=None):
+        """
+        Submits the request to generate a district export using a session that is logged into Lexia.
+        :param session: A requests.Session carrying a Lexia login.
+        :param report_type: The text from one of 'Report type' options listed in the myLexia
+            'District Exports' modal.
+        :param period_start_date: The start date for the report request
+        :param period_end_date: The end date for the report request
+        :param district_id: The district to export. Defaults to the district_id this object was created with.
+        :return: Boolean. Whether or not the export request was successful.
+        """
+        if district_id is None:
+            district_id = self.district_id
+
         # use requests to post the download request
-        with requests.Session() as s:
-            for cookie in self.driver.get_cookies():
-                s.cookies.set(cookie['name'], cookie['value'])
-
-            payload = {
-                "districtID": self.district_id,
-                "type": report_type,
-                "email": self.district_export_email_address,
-                "startDate": period_start_date.strftime("%Y-%m-%d"),
-                "endDate": period_end_date.strftime("%Y-%m-%d")
-            }
-            self.log.info('{}: Export request payload: {}'.format(self.district_id, payload))
-            download_response = s.put(self.base_url + '/exportData/progress', data=payload)
-
-            if download_response.ok:
-                self.log.info('{}: Export request for {} succeeded for user: {}'.format(
-                    self.district_id, report_type, self.username
-                ))
-                j_data = json.loads(download_response.content.decode())
-                self.log.info(j_data)
-                return True
-            else:
-                self.log.info('{}: Export request for {} FAILED  for user: {}'.format(
-                    self.district_id, report_type, self.username
-                ))
-                self.log.info(download_response.content)
-                return False
+        payload = {
+            "districtID": district_id,
+            "type": report_type,
+            "email": self.district_export_email_address,
+            "startDate": period_start_date.strftime("%Y-%m-%d"),
+            "endDate": period_end_date.strftime("%Y-%m-%d")
+        }
+        self.log.info('{}: Export request payload: {}'.format(district_id, payload))
+        download_response = session.put(self.base_url + '/exportData/progress', data=payload)
+
+        if download_response.ok:
+            self.log.info('{}: Export request for {} succeeded for user: {}'.format(
+                district_id, report_type, self.username
+            ))
+            j_data = json.loads(download_response.content.decode())
+            self.log.info(j_data)
+            return True
+        else:
+            self.log.info('{}: Export request for {} FAILED  for user: {}'.format(
+                district_id, report_type, self.username
+            ))
+            self.log.info(download_response.content)
+            return False
 
-    def __get_exportid_from_email(self):
-        """Log into an IMAP email server and get messages in a specific folder.
-        Checks for a new Lexia export_id in those messages.
+    def __connect_to_export_mailbox(self):
+        """Log into an IMAP email server and select the folder Lexia export emails are filed in.
 
         Returns:
-            int: the export_id
+            imaplib.IMAP4_SSL: the connection, with the export email folder selected
         """
-        self.log.info('Checking email for latest report ID for district_id: ' + str(self.district_id))
         imap_conn = imaplib.IMAP4_SSL(self.district_export_email_imap_uri)
 
         try:
@@ -357,20 +971,44 @@ class Lexia(WebUIDataSource, LoggingMixin):
             sys.exit(1)
 
         rv, data = imap_conn.select('"{}"'.format(self.district_export_email_folder))
-        if rv == 'OK':
-            self.log.info('Processing mailbox for ' + self.district_export_email_address +
-                          ' in folder "' + self.district_export_email_folder + '"')
-            export_id = self.__extract_lexia_export_id_from_email(imap_conn)
-            if export_id == -1:
-                raise ValueError('No new export_id found on ' + self.district_export_email_address)
-            else:
-                imap_conn.close()
-                return export_id
-
-        else:
+        if rv != 'OK':
+            imap_conn.logout()
             raise InvalidIMAPParameters(
                 "ERROR: Unable to open mailbox. Check your parameters and email folder. Message: ", rv)
+
+        # UIDs are only comparable between sessions while the folder's UIDVALIDITY is unchanged
+        uidvalidity = imap_conn.response('UIDVALIDITY')[1][0]
+        if uidvalidity != self.__export_email_uidvalidity:
+            self.__export_email_uidvalidity = uidvalidity
+            self.__last_export_email_uid = 0
+
+        self.log.info('Processing mailbox for ' + self.district_export_email_address +
+                      ' in folder "' + self.district_export_email_folder + '"')
+        return imap_conn
+
+    def __disconnect_from_export_mailbox(self, imap_conn):
+        """Closes the export email folder and logs out of the IMAP server."""
+        try:
+            imap_conn.close()
             imap_conn.logout()
+        except imaplib.IMAP4.error as err:
+            self.log.debug('Error while closing the export mailbox: {}'.format(err))
+
+    def __get_exportid_from_email(self, imap_conn):
+        """Checks for a new Lexia export_id in the messages in the export email folder.
+
+        Args:
+            imap_conn (imaplib.IMAP4_SSL): A connection with the export email folder selected.
+
+        Returns:
+            int: the export_id
+        """
+        self.log.info('Checking email for latest report ID for district_id: ' + str(self.district_id))
+        export_id = self.__extract_lexia_export_id_from_email(imap_conn)
+        if export_id == -1:
+            raise ValueError('No new export_id found on ' + self.district_export_email_address)
+        else:
+            return export_id
 
     def __extract_lexia_export_id_from_email(self, imap_conn):
         """ Extract the export_id that is sent by Lexia that is needed to
@@ -381,88 +1019,244 @@ class Lexia(WebUIDataSource, LoggingMixin):
         not times. Therefore, we will search within the folder for messages 
         since yesterday.
 
+        The search is done by UID and starts after the highest UID that has
+        already been processed, so later polls only look at new mail. For
+        each new message only the Date and Subject headers, the message
+        structure and the text/plain part with the export link are fetched.
+
         Args:
             imap_conn (imaplib.IMAP4_SSL): A current connection to an IMAP
                 email account.
 
         Returns:
-            int: The new export_id
+            int: The highest export_id seen so far, or -1 if none has been found.
         """
+        self.__fetch_new_export_emails(imap_conn)
+
+        return self.__highest_export_id
+
+    def __fetch_new_export_emails(self, imap_conn, advance_cursor=True):
+        """Fetches the export emails that have not been processed yet and records the export_ids in them.
+
+        Args:
+            imap_conn (imaplib.IMAP4_SSL): A current connection to an IMAP
+                email account.
+            advance_cursor (bool): Whether to mark the emails as processed. If False, the caller moves
+                the UID cursor itself once it is done with each email.
+
+        Returns:
+            list: (uid, message, export_ids) tuples for the new emails, oldest first.
+        """
+        new_emails = []
+        for uid in self.__search_new_export_email_uids(imap_conn):
+            msg = self.__fetch_export_email(imap_conn, uid)
+            if msg is None:
+                # stop here so this message is fetched again on the next poll
+                self.log.error('ERROR getting email message {}'.format(uid))
+                break
+
+            self.log.info('Processing Message %s, Raw Date: %s' % (uid, msg['Date']))
+            export_ids = self.__find_export_ids_in_message(msg)
+            if not export_ids:
+                self.log.warning('No export_id found in the text of email message {}'.format(uid))
+            for export_id in export_ids:
+                self.log.info('export_id found: ' + str(export_id))
+                if export_id > self.__highest_export_id:
+                    self.__highest_export_id = export_id
+
+            if advance_cursor:
+                self.__last_export_email_uid = int(uid)
+            new_emails.append((int(uid), msg, export_ids))
+
+        return new_emails
+
+    def __search_new_export_email_uids(self, imap_conn):
+        """Returns the UIDs (as bytes, oldest first) of export emails that have not been processed yet."""
+        criteria = []
+        if self.__last_export_email_uid:
+            criteria += ['UID', '{}:*'.format(self.__last_export_email_uid + 1)]
         # get all messages received in the last day
-        rv, data = imap_conn.search(None, '(SINCE ' +
-                                    (dt.datetime.now() - dt.timedelta(1)).strftime("%d-%b-%Y") + ')')
+        criteria += ['SINCE', (dt.datetime.now() - dt.timedelta(1)).strftime("%d-%b-%Y")]
+        if self.district_export_email_sender:
+            criteria += ['FROM', '"{}"'.format(self.district_export_email_sender)]
+        if self.district_export_email_subject:
+            criteria += ['SUBJECT', '"{}"'.format(self.district_export_email_subject)]
+
+        rv, data = imap_conn.uid('SEARCH', None, '({})'.format(' '.join(criteria)))
         if rv != 'OK':
             self.log.warning("No email messages found!")
-            # TODO change this to raise an error
-            return -1
-
-        highest_export_id = -1
-        for num in data[0].split():
-            rv, data = imap_conn.fetch(num, '(RFC822)')
-            if rv != 'OK':
-                # TODO change this to raise an error
-                self.log.error("ERROR getting email message", num)
-                return -1
-
-            msg = email.message_from_bytes(data[0][1])
-            self.log.info('Processing Message %s, Raw Date: %s' % (num, msg['Date']))
-            highest_export_id = 0
-            for part in msg.walk():
-                # each part is a either non-multipart, or another multipart message
-                # that contains further parts... Message is organized like a tree
-                if part.get_content_type() == 'text/plain':
-                    # get the raw text
-                    part_str = part.get_payload()
-                    # extract the report id
-                    match = re.search(r'(?<=id=)(\d*?)(?=\s)', part_str)
-                    if match:
-                        export_id = int(match.group(0))
-                        self.log.info('export_id found: ' + str(export_id))
-                        if export_id > highest_export_id:
-                            highest_export_id = export_id
-
-        return highest_export_id
-
-    def __download_export_for_exportid(self, export_id, write_to_disk=None, pandas_read_csv_kwargs={}):
+            return []
+
+        # 'n:*' always matches the newest message, even when its UID is below n
+        return [uid for uid in data[0].split() if int(uid) > self.__last_export_email_uid]
+
+    def __fetch_export_email(self, imap_conn, uid):
+        """Fetches the Date and Subject headers and the text/plain part of an export email.
+
+        Args:
+            imap_conn (imaplib.IMAP4_SSL): A connection with the export email folder selected.
+            uid (bytes): The UID of the email.
+        Returns:
+            email.message.Message: A text/plain message with the email's headers and its decoded text/plain
+                part, which is empty if the email has none, or None if a fetch failed.
+        """
+        rv, data = imap_conn.uid('FETCH', uid, LEXIA_EXPORT_EMAIL_FETCH_ITEMS)
+        if rv != 'OK':
+            return None
+
+        header, bodystructure = self.__parse_export_email_fetch_response(data)
+        msg = email.message_from_bytes(header)
+        msg.set_payload('')
+
+        text_part = find_imap_text_plain_part(bodystructure) if bodystructure else None
+        if text_part is None:
+            self.log.warning('Email message {} has no text/plain part'.format(uid))
+            return msg
+
+        section, encoding, charset = text_part
+        rv, data = imap_conn.uid('FETCH', uid, '(BODY.PEEK[{}])'.format(section))
+        if rv != 'OK':
+            return None
+
+        text = next((item[1] for item in data if isinstance(item, tuple)), b'')
+        if encoding == 'base64':
+            text = base64.b64decode(text)
+        elif encoding == 'quoted-printable':
+            text = quopri.decodestring(text)
+        try:
+            msg.set_payload(text.decode(charset or 'us-ascii', errors='replace'))
+        except LookupError:
+            msg.set_payload(text.decode('utf-8', errors='replace'))
+
+        return msg
+
+    @staticmethod
+    def __parse_export_email_fetch_response(data):
+        """Splits a LEXIA_EXPORT_EMAIL_FETCH_ITEMS response into the header bytes and the parsed BODYSTRUCTURE."""
+        header = b''
+        response_text = b''
+        for item in data:
+            if isinstance(item, tuple):
+                response_text += item[0]
+                if b'HEADER.FIELDS' in item[0].upper():
+                    header = item[1]
+            elif isinstance(item, bytes):
+                response_text += item
+
+        match = re.search(rb'BODYSTRUCTURE\s*(\(.*)', response_text, re.IGNORECASE | re.DOTALL)
+        if match is None:
+            return header, None
+
+        return header, parse_imap_list(match.group(1).decode('utf-8', errors='replace'))
+
+    @staticmethod
+    def __find_export_ids_in_message(msg):
+        """Returns the export_ids in the text/plain parts of an email message."""
+        export_ids = []
+        for part in msg.walk():
+            # each part is a either non-multipart, or another multipart message
+            # that contains further parts... Message is organized like a tree
+            if part.get_content_type() == 'text/plain':
+                # get the raw text
+                part_str = part.get_payload()
+                # extract the report id
+                match = re.search(r'(?<=id=)(\d*?)(?=\s)', part_str)
+                if match and match.group(0):
+                    export_ids.append(int(match.group(0)))
+
+        return export_ids
+
+    def __download_export_for_exportid(self, export_id, write_to_disk=None, pandas_read_csv_kwargs={},
+                                       session=None, local_copy_path=None, return_dataframe=True,
+                                       hash_algorithm=None):
         """Logs into lexia and downloads the report associated with a specific
         export_id.
 
+        The response is streamed to write_to_disk (and local_copy_path) exactly as Lexia sent it, so the
+        file on disk is the original CSV rather than one re-written by pandas.
+
         Args:
             export_id (int): The Lexia export id to download.
             write_to_disk (str): A path where the CSV that has been downloaded should be written to disk.
             pandas_read_csv_kwargs (dict): kwargs to pass to the Pandas read_csv function as necessary
+            session (requests.Session): A session logged into Lexia. If not provided, one is built from the
+                driver's cookies and the driver is closed once the export has been downloaded.
+            local_copy_path (str): A path where the export should be kept exactly as Lexia sent it.
+            return_dataframe (bool): Whether to parse the export. If False, write_to_disk is required and the
+                export is only written to disk.
+            hash_algorithm (str): A hashlib algorithm name (e.g. 'sha256'). If given, a digest of the export is
+                logged and, if write_to_disk is set, written next to it as <write_to_disk>.<hash_algorithm>
         Returns:
-            A Pandas dataframe with the report contents
+            A Pandas dataframe with the report contents, or the write_to_disk path if return_dataframe is False
         """
+        if not return_dataframe and not write_to_disk:
+            raise ValueError('write_to_disk is required when return_dataframe is False.')
+
         self.log.info(str(self.district_id) + ': downloading report with export_id=' +
                       str(export_id))
-        with requests.Session() as s:
-            for cookie in self.driver.get_cookies():
-                s.cookies.set(cookie['name'], cookie['value'])
-
-            export_url = self.base_url + '/reports/get_export.php' + '?id=' + str(export_id)
-            download_response = s.get(export_url)
+        close_driver = session is None
+        if session is None:
+            session = requests_session_from_driver(self.driver)
+
+        export_url = self.base_url + '/reports/get_export.php' + '?id=' + str(export_id)
+        content_hash = hashlib.new(hash_algorithm) if hash_algorithm else None
+        output_paths = [path for path in (write_to_disk, local_copy_path) if path]
+        with session.get(export_url, stream=True) as download_response:
+            if not download_response.ok:
+                raise ValueError('Report download request failed')
 
-            # Logging as debug, because it will otherwise log all the data in the report
-            self.log.debug('Report download request response for export_id {}: {}'.format(
-                export_id,
-                download_response.content
-            ))
+            if output_paths:
+                content = None
+                output_files = [open(path, 'wb') for path in output_paths]
+                try:
+                    for chunk in download_response.iter_content(chunk_size=LEXIA_DOWNLOAD_CHUNK_SIZE):
+                        for f in output_files:
+                            f.write(chunk)
+                        if content_hash:
+                            content_hash.update(chunk)
+                finally:
+                    for f in output_files:
+                        f.close()
+            else:
+                content = download_response.content
+                if content_hash:
+                    content_hash.update(content)
 
-            if download_response.ok:
-                df_report = pd.read_csv(io.StringIO(download_response.content.decode(LEXIA_CSV_ENCODING)),
-                                        **pandas_read_csv_kwargs)
+        # Logging as debug, because it will otherwise log all the data in the report
+        if content is not None:
+            self.log.debug('Report download request response for export_id {}: {}'.format(export_id, content))
 
-                # if the dataframe is empty (the report had no data), raise an error
-                if df_report.shape[0] == 0:
-                    raise NoDataError('No data in report for user {} at url: {}'.format(
-                        self.username, export_url))
+        try:
+            if return_dataframe:
+                df_report = pd.read_csv(output_paths[0] if content is None else io.BytesIO(content),
+                                        **dict({'encoding': LEXIA_CSV_ENCODING}, **pandas_read_csv_kwargs))
+                has_data = df_report.shape[0] > 0
             else:
-                raise ValueError('Report download request failed')
-
-        self.driver.close()
+                df_report = None
+                has_data = _csv_file_has_data_rows(write_to_disk)
+
+            # if the export is empty (the report had no data), raise an error
+            if not has_data:
+                raise NoDataError('No data in report for user {} at url: {}'.format(
+                    self.username, export_url))
+        except NoDataError:
+            for path in output_paths:
+                os.remove(path)
+            raise
+
+        if close_driver:
+            session.close()
+            self.driver.close()
 
-        if write_to_disk:
-            df_report.to_csv(write_to_disk)
+        if content_hash:
+            self.log.info('{}: export_id {} {} digest: {}'.format(
+                self.district_id, export_id, hash_algorithm, content_hash.hexdigest()
+            ))
+            if write_to_disk:
+                with open('{}.{}'.format(write_to_disk, hash_algorithm), 'w') as f:
+                    f.write(content_hash.hexdigest())
 
-        return df_report
+        if return_dataframe:
+            return df_report
+        else:
+            return write_to_disk
@@ -12,6 +12,7 @@ from ducttape.utils import (
     interpret_report_url,
     wait_for_any_file_in_folder,
     get_most_recent_file_in_dir,
+    read_spreadsheet,
     delete_folder_contents,
     DriverBuilder,
 )
@@ -89,8 +90,8 @@ class Mealtime(WebUIDataSource):
             report_df = pd.read_csv(get_most_recent_file_in_dir(csv_download_folder_path),
                                       header=header_row)
         else:
-            report_df = pd.read_excel(get_most_recent_file_in_dir(csv_download_folder_path),
-                                      header=3)
+            report_df = read_spreadsheet(get_most_recent_file_in_dir(csv_download_folder_path),
+                                         header=3)
 
         # delete any files in the mealtime temp folder; we don't need them now
         # TODO: move this out of this function. It should happen as cleanup once
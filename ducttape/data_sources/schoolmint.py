@@ -15,16 +15,24 @@ from selenium.common.exceptions import (
     TimeoutException,
     NoSuchElementException,
     ElementNotVisibleException,
+    WebDriverException,
 )
 from selenium.webdriver.common.by import By
 import pandas as pd
+import requests
 import time
 import datetime
 import os
 import glob
 import re
+import json
 import shutil
-from tempfile import mkdtemp
+from tempfile import mkdtemp, gettempdir
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from collections.abc import Mapping
+from threading import Lock, local
+import zipfile
 
 # local import
 from ducttape.webui_datasource import WebUIDataSource
@@ -32,11 +40,12 @@ from ducttape.utils import (
     configure_selenium_chrome,
     interpret_report_url,
     wait_for_any_file_in_folder,
+    wait_for_new_file_in_folder,
     get_most_recent_file_in_dir,
+    requests_session_from_driver,
     delete_folder_contents,
     DriverBuilder,
     LoggingMixin,
-    ZipfileLongPaths,
 )
 from ducttape.exceptions import (
     ReportNotReady,
@@ -48,10 +57,166 @@ from ducttape.exceptions import (
 SCHOOLMINT_DEFAULT_EXPORT_ENCODING = 'utf-8-sig'
 WALKME_AND_SUPPORT_TIMEOUT = 5
 NUMBER_OF_RETRIES = 3
+# The number of threads the csvs in a zipped custom report are parsed on, unless prefetch_workers is passed
+ZIP_CUSTOM_REPORT_PARSE_WORKERS = 4
 
 GENERATE_REPORT_BUTTON_XPATH = (
     "//tr[td[text() = '{report_name}' or text() = ' {report_name} ']]//button[contains(@class, 'export-data')]"
 )
+DOWNLOAD_REPORT_LINK_XPATH = (
+    "//tr[td[text() = '{report_name}' or text() = ' {report_name} ']]//a[contains(text(), 'Download')]"
+)
+# Counts the page's in-flight XHR and fetch requests to its own origin (third party widgets like Walk-Me are
+# ignored), so we can tell when the requests that fill the stream table have finished. Installed with the Chrome
+# DevTools Protocol before navigating so that it sees the first request the page makes.
+NETWORK_IDLE_TRACKER_SCRIPT = """
+(function () {
+    if (window.__ducttapePendingRequests !== undefined) { return; }
+    window.__ducttapePendingRequests = 0;
+    window.__ducttapeLastRequestAt = Date.now();
+    function isTracked(url) {
+        try { return new URL(url, window.location.href).origin === window.location.origin; }
+        catch (e) { return false; }
+    }
+    function started() { window.__ducttapePendingRequests++; window.__ducttapeLastRequestAt = Date.now(); }
+    function finished() { window.__ducttapePendingRequests--; window.__ducttapeLastRequestAt = Date.now(); }
+    var open = XMLHttpRequest.prototype.open;
+    XMLHttpRequest.prototype.open = function (method, url) {
+        this.__ducttapeTracked = isTracked(url);
+        return open.apply(this, arguments);
+    };
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        if (this.__ducttapeTracked) {
+            started();
+            this.addEventListener('loadend', finished);
+        }
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function (input) {
+            if (!isTracked(typeof input === 'string' ? input : input.url)) { return fetch.apply(this, arguments); }
+            started();
+            return fetch.apply(this, arguments).then(
+                function (response) { finished(); return response; },
+                function (error) { finished(); throw error; }
+            );
+        };
+    }
+})();
+"""
+# null if the tracker isn't installed, otherwise whether no request has been in flight for arguments[0] ms
+NETWORK_IDLE_CHECK_SCRIPT = """
+if (window.__ducttapePendingRequests === undefined) { return null; }
+return window.__ducttapePendingRequests <= 0 && Date.now() - window.__ducttapeLastRequestAt >= arguments[0];
+"""
+# how long the page must go without a request before the stream table is considered loaded, in seconds
+STREAM_TABLE_QUIET_PERIOD = 0.5
+
+CUSTOM_REPORTS_PAGE_XPATH = '//*[@id="content"]//*[@class="pagination "]/li[@data-page={}]/a'
+CUSTOM_REPORTS_LINKED_PAGES_XPATH = '//*[@id="content"]//*[@class="pagination "]/li[@data-page][a]'
+# Where the page and row of each custom report is remembered between runs (see __navigate_to_custom_report)
+SCHOOLMINT_CUSTOM_REPORT_INDEX_FILENAME = 'schoolmint_custom_report_index.json'
+# Reads every custom report row on the current page in one round trip to the browser. A report's name is the
+# first cell with text of its own, matching the td[text() = ...] lookups in the XPaths above. The last generated
+# date is in a 'last_generated_date-td' cell in the new custom reports interface and the fourth cell in the old one.
+CUSTOM_REPORT_ROWS_SCRIPT = """
+var rows = document.querySelectorAll('#content tr');
+var reports = [];
+for (var i = 0; i < rows.length; i++) {
+    var button = rows[i].querySelector('button.export-data');
+    if (!button) { continue; }
+    var cells = rows[i].querySelectorAll('td');
+    var name = null;
+    for (var j = 0; j < cells.length && name === null; j++) {
+        var text = '';
+        for (var k = 0; k < cells[j].childNodes.length; k++) {
+            if (cells[j].childNodes[k].nodeType === Node.TEXT_NODE) { text += cells[j].childNodes[k].nodeValue; }
+        }
+        if (text.trim()) { name = text.trim(); }
+    }
+    var generated = rows[i].querySelector('td[class*="last_generated_date"]') || cells[3];
+    reports.push({
+        name: name,
+        row_id: rows[i].id || null,
+        button_text: button.textContent.trim(),
+        last_generated: generated ? generated.textContent.trim() : null
+    });
+}
+return reports;
+"""
+
+
+class ZipCustomReport(Mapping):
+    """The CSVs in a zipped SchoolMint Custom Report, as a read-only mapping of file name to Pandas DataFrame.
+
+    Each CSV is read straight out of the zip file, without extracting it, the first time it is accessed, and
+    then kept. Passing prefetch_workers starts parsing every CSV on a thread pool straight away, so that the
+    DataFrames are ready (or nearly) by the time they are accessed.
+    """
+
+    def __init__(self, file_path, pandas_read_csv_kwargs={}, prefetch_workers=0):
+        """
+        :param file_path: The path to the zip file.
+        :param pandas_read_csv_kwargs: Additional keyward arguments to pass to Panda's read_csv function.
+        :param prefetch_workers: The number of threads to parse the CSVs in the background with. If 0,
+            each CSV is only parsed when it is first accessed.
+        """
+        self.file_path = file_path
+        self.pandas_read_csv_kwargs = pandas_read_csv_kwargs
+        with zipfile.ZipFile(file_path) as zf:
+            # the report CSVs are at the top level of the zip
+            self.__members = [
+                info.filename for info in zf.infolist()
+                if info.filename.endswith('.csv') and '/' not in info.filename
+            ]
+        self.__dfs = dict()
+        self.__futures = dict()
+        self.__lock = Lock()
+
+        if prefetch_workers:
+            executor = ThreadPoolExecutor(max_workers=prefetch_workers)
+            with self.__lock:
+                for csv_filename in self.__members:
+                    self.__futures[csv_filename] = executor.submit(self.__read_member, csv_filename)
+            # lets the threads exit once the queued members have been parsed
+            executor.shutdown(wait=False)
+
+    def __read_member(self, csv_filename):
+        # find the files that start with a number, these are the custom forms files, which have a title row
+        # above the header and a row of descriptions below it
+        if re.match(r"^(\d+)", csv_filename):
+            skiprows = [0, 2]
+        # otherwise it is the info file that comes along with the zip export (application-data-export, etc.)
+        else:
+            skiprows = None
+
+        # each read opens the zip file itself so that members can be read from several threads at once
+        with zipfile.ZipFile(self.file_path) as zf:
+            with zf.open(csv_filename) as f:
+                return pd.read_csv(f, encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING, skiprows=skiprows,
+                                   **self.pandas_read_csv_kwargs)
+
+    def __getitem__(self, csv_filename):
+        if csv_filename not in self.__members:
+            raise KeyError(csv_filename)
+
+        with self.__lock:
+            df = self.__dfs.get(csv_filename)
+            future = self.__futures.get(csv_filename)
+        if df is not None:
+            return df
+
+        df = future.result() if future is not None else self.__read_member(csv_filename)
+        with self.__lock:
+            return self.__dfs.setdefault(csv_filename, df)
+
+    def __iter__(self):
+        return iter(self.__members)
+
+    def __len__(self):
+        return len(self.__members)
 
 
 class SchoolMint(WebUIDataSource, LoggingMixin):
@@ -66,10 +231,16 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         super().__init__(username, password, wait_time, hostname, temp_folder_path, headless)
         self.uri_scheme = 'https://'
         self.base_url = self.uri_scheme + self.hostname
+        self.__custom_report_index = None
+        self.__custom_reports_page = None
+        # the school year selected in the current session, as far as we know (see __select_school_year)
+        self.__school_year = None
 
     def _login(self):
         """ Logs into the provided SchoolMint instance.
         """
+        # a new session starts on whatever year SchoolMint remembers for the user
+        self.__school_year = None
         # 2019-01-16 SchoolMint seems to be having some issues with loading the login screen recently,
         # so we'll add a retry here
         count = 0
@@ -214,9 +385,32 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
 
         if not driver:
             self.driver.close()
+        else:
+            self.__school_year = school_year
 
         return True
 
+    def __select_school_year(self, school_year):
+        """Makes sure a school year is selected in the current session, only switching years when it isn't.
+
+        _set_year reloads the whole interface, so the year is first checked against the one we last selected
+        in this session and then against the year selector.
+        """
+        if self.__school_year == school_year:
+            self.log.debug('School year {} is already selected.'.format(school_year))
+            return
+
+        try:
+            is_selected = self.check_school_year(school_year)
+        except NoSuchElementException:
+            is_selected = False
+
+        if is_selected:
+            self.log.debug('School year {} is already selected.'.format(school_year))
+            self.__school_year = school_year
+        else:
+            self._set_year(school_year, self.driver)
+
     def check_school_year(self, school_year):
         """Checks that the school year is set as expected in the UI."""
         elem = self.driver.find_element(
@@ -228,9 +422,14 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         else:
             return False
 
-    def download_url_report(self, report_url, school_year, temp_folder_name=None, pandas_read_csv_kwargs={}):
+    def download_url_report(self, report_url, school_year, temp_folder_name=None, pandas_read_csv_kwargs={},
+                            transport='browser', export_url=None):
         """ Downloads a SchoolMint data-stream-table report.
 
+        With the default 'browser' transport, the report is loaded in the browser and exported with its
+        export button. With the 'http' transport, the browser is only used to log in and select the year;
+        the CSV export is then requested directly with the browser's cookies and streamed into Pandas.
+
         Args:
             report_url (string): Information pertaining to the path and query
                 string for the report whose access is desired. Any filtering
@@ -240,9 +439,20 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
                 browser will be temporarily stored. If this directory does not exist, it will be
                 created. NOTE: This sub-directory will be
             pandas_read_csv_kwargs: additional arguments to pass to Pandas read_csv
+            transport (string): 'browser' or 'http'
+            export_url (string): For the 'http' transport, the path and query string of the CSV export (the
+                request the export button makes). '{query}' in it is replaced with report_url's query string,
+                e.g. '/report/export?{query}'. If not provided, it is read from the export button's href or
+                data attributes on the report page; if the button has neither (it builds the request in
+                JavaScript), a ValueError is raised and export_url has to be passed.
 
         Returns: A Pandas DataFrame of the report contents.
         """
+        if transport == 'http':
+            return self.__download_url_report_over_http(report_url, school_year, export_url, pandas_read_csv_kwargs)
+        elif transport != 'browser':
+            raise ValueError("transport must be 'browser' or 'http', not: {}".format(transport))
+
         if temp_folder_name:
             csv_download_folder_path = self.temp_folder_path + '/' + temp_folder_name
         else:
@@ -250,11 +460,159 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
 
         # set up the driver for execution
         self.driver = DriverBuilder().get_driver(csv_download_folder_path, self.headless)
+        self.__install_network_idle_tracker()
         self._login()
         # Clear pop-ups by reloading page
         self.driver.get(self.base_url)
-        self._set_year(school_year, self.driver)
+        self.__select_school_year(school_year)
+
+        try:
+            report_df = self.__export_stream_table(report_url, school_year, csv_download_folder_path,
+                                                   pandas_read_csv_kwargs)
+        finally:
+            # TODO: move this out of this function. It should happen as cleanup once
+            # the whole DAG has completed
+            #delete_folder_contents(csv_download_folder_path)
+            shutil.rmtree(csv_download_folder_path, ignore_errors=True)
+
+            # close the driver for this task
+            self.driver.close()
+
+        return report_df
+
+    def download_url_reports(self, reports, temp_folder_name=None, transport='browser', max_workers=4):
+        """ Downloads several SchoolMint data-stream-table reports with one login.
+
+        The reports are grouped by school year so that the year is switched at most once per year. A report
+        that fails to download doesn't stop the others; the exception it raised is returned in its place.
+
+        Args:
+            reports (list): A (report_url, school_year, pandas_read_csv_kwargs) tuple for each report (see
+                download_url_report). pandas_read_csv_kwargs can be left out. For the 'http' transport, an
+                export_url can be added as a fourth item. Each report_url can only be listed once per school
+                year, since the results are keyed by both.
+            temp_folder_name (string): The name for a sub-directory in which the files from the
+                browser will be temporarily stored.
+            transport (string): 'browser' or 'http' (see download_url_report)
+            max_workers (int): For the 'http' transport, the number of reports for a school year to download
+                at the same time.
+
+        Returns: A dict keyed by (report_url, school_year) of a Pandas DataFrame of each report's contents,
+            or of the exception raised while downloading it.
+        """
+        if transport not in ('browser', 'http'):
+            raise ValueError("transport must be 'browser' or 'http', not: {}".format(transport))
+
+        reports_by_year = OrderedDict()
+        for report in reports:
+            report_url, school_year = report[0], report[1]
+            pandas_read_csv_kwargs = report[2] if len(report) > 2 else {}
+            export_url = report[3] if len(report) > 3 else None
+            if any(report_url == year_report[0] for year_report in reports_by_year.get(school_year, [])):
+                raise ValueError('Report {} is listed more than once for school year {}.'.format(report_url,
+                                                                                                 school_year))
+            reports_by_year.setdefault(school_year, []).append((report_url, pandas_read_csv_kwargs, export_url))
+
+        if temp_folder_name:
+            csv_download_folder_path = self.temp_folder_path + '/' + temp_folder_name
+        else:
+            csv_download_folder_path = mkdtemp(dir=self.temp_folder_path)
+
+        # set up the driver for execution
+        self.driver = DriverBuilder().get_driver(csv_download_folder_path, self.headless)
+        self.__install_network_idle_tracker()
+        self._login()
+
+        results = dict()
+        try:
+            for school_year, year_reports in reports_by_year.items():
+                try:
+                    # Clear pop-ups by reloading page
+                    self.driver.get(self.base_url)
+                    self.__select_school_year(school_year)
+                except Exception as e:
+                    self.log.warning('Could not select school year {}: {}'.format(school_year, e))
+                    for report_url, _, _ in year_reports:
+                        results[(report_url, school_year)] = e
+                    continue
+
+                if transport == 'http':
+                    year_results = self.__download_stream_table_exports_over_http(year_reports, max_workers)
+                    for report_url, result in year_results.items():
+                        results[(report_url, school_year)] = result
+                    continue
+
+                for report_url, pandas_read_csv_kwargs, _ in year_reports:
+                    try:
+                        results[(report_url, school_year)] = self.__export_stream_table(
+                            report_url, school_year, csv_download_folder_path, pandas_read_csv_kwargs
+                        )
+                    except Exception as e:
+                        self.log.warning('Failed to download report {}: {}'.format(report_url, e))
+                        results[(report_url, school_year)] = e
+        finally:
+            shutil.rmtree(csv_download_folder_path, ignore_errors=True)
+            self.driver.close()
+
+        return results
+
+    def __download_stream_table_exports_over_http(self, reports, max_workers=4):
+        """ Downloads the CSV exports of several reports for the school year selected in the driver at once.
+
+        Args:
+            reports (list): (report_url, pandas_read_csv_kwargs, export_url) tuples. Export URLs that are None
+                are found on the report pages first.
+            max_workers (int): The number of exports to download at the same time.
 
+        Returns: A dict keyed by report_url of a Pandas DataFrame or the exception raised downloading it.
+        """
+        results = dict()
+        export_download_urls = dict()
+        for report_url, _, export_url in reports:
+            try:
+                export_download_urls[report_url] = self.__get_stream_table_export_url(report_url, export_url)
+            except Exception as e:
+                self.log.warning('Could not find the export URL for report {}: {}'.format(report_url, e))
+                results[report_url] = e
+
+        # requests.Session isn't thread-safe, so each download thread gets its own session with the driver's cookies
+        with requests_session_from_driver(self.driver) as driver_session:
+            thread_sessions = local()
+            sessions = []
+
+            def read_stream_table_export(export_download_url, pandas_read_csv_kwargs):
+                if not hasattr(thread_sessions, 'session'):
+                    thread_sessions.session = requests.Session()
+                    thread_sessions.session.cookies.update(driver_session.cookies)
+                    sessions.append(thread_sessions.session)
+                return self.__read_stream_table_export(thread_sessions.session, export_download_url,
+                                                       pandas_read_csv_kwargs)
+
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        report_url: executor.submit(read_stream_table_export, export_download_urls[report_url],
+                                                    pandas_read_csv_kwargs)
+                        for report_url, pandas_read_csv_kwargs, _ in reports if report_url in export_download_urls
+                    }
+                    for report_url, future in futures.items():
+                        try:
+                            results[report_url] = future.result()
+                        except Exception as e:
+                            self.log.warning('Failed to download report {}: {}'.format(report_url, e))
+                            results[report_url] = e
+            finally:
+                for session in sessions:
+                    session.close()
+
+        return results
+
+    def __export_stream_table(self, report_url, school_year, csv_download_folder_path, pandas_read_csv_kwargs={}):
+        """ Exports a data-stream-table report with the logged in driver, which must download to
+        csv_download_folder_path and have school_year selected.
+
+        Returns: A Pandas DataFrame of the report contents.
+        """
         # get the report url
         self.driver.get(interpret_report_url(self.base_url, report_url))
         self.__remove_walk_me_and_support()
@@ -268,8 +626,147 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         if not self.check_school_year(school_year):
             raise ReportNotFound("Wrong school detected prior to clicking generate.")
 
-        self.log.debug('Waiting for report-data-summary to load')
+        self.log.debug('Waiting for the stream table to load')
         # wait until the stream table is fully loaded before downloading
+        if not self.__wait_for_network_idle():
+            self.__wait_for_report_data_summary_to_settle()
+
+        # click the button to download the report
+        self.log.debug('Starting download...')
+        existing_files = os.listdir(csv_download_folder_path) if os.path.isdir(csv_download_folder_path) else []
+        elem = self.driver.find_element(By.CLASS_NAME, "export-table")
+        elem.click()
+
+        # wait until the new file has downloaded; other reports may already be in the folder
+        file_path = wait_for_new_file_in_folder(csv_download_folder_path, existing_files)
+        if file_path is None:
+            raise TimeoutError('SchoolMint report did not finish downloading from: {}'.format(report_url))
+
+        self.log.debug('Download finished.')
+        report_df = pd.read_csv(file_path, encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING, **pandas_read_csv_kwargs)
+
+        # if the dataframe is empty (the report had no data), raise an error
+        if report_df.shape[0] == 0:
+            raise ValueError('No data in report for user {} at url: {}'.format(
+                self.username, interpret_report_url(self.base_url, report_url)))
+
+        return report_df
+
+    def __download_url_report_over_http(self, report_url, school_year, export_url=None, pandas_read_csv_kwargs={}):
+        """ Downloads a SchoolMint data-stream-table report by requesting its CSV export with the browser's login.
+
+        Args:
+            report_url (string): The path and query string for the report (see download_url_report).
+            school_year (string): The SchoolMint school year to download from (e.g. '2018-2019')
+            export_url (string): The path and query string of the CSV export (see download_url_report). Found on
+                the report page if None.
+            pandas_read_csv_kwargs: additional arguments to pass to Pandas read_csv
+
+        Returns: A Pandas DataFrame of the report contents.
+        """
+        self.driver = DriverBuilder().get_driver(headless=self.headless)
+        self._login()
+        try:
+            # the school year is kept in the server side session, so it has to be set before exporting
+            self.driver.get(self.base_url)
+            self.__select_school_year(school_year)
+            export_download_url = self.__get_stream_table_export_url(report_url, export_url)
+            session = requests_session_from_driver(self.driver)
+        finally:
+            self.driver.close()
+
+        with session:
+            return self.__read_stream_table_export(session, export_download_url, pandas_read_csv_kwargs)
+
+    def __get_stream_table_export_url(self, report_url, export_url=None):
+        """Works out the full URL of a data-stream-table report's CSV export.
+
+        The export endpoint can't be derived from report_url alone, so without an export_url it is read from the
+        report page's export button (see __find_stream_table_export_url). Any '{query}' in export_url is
+        replaced with report_url's query string, so one export_url can serve reports with different filters.
+        """
+        if not export_url:
+            return self.__find_stream_table_export_url(report_url)
+
+        query = report_url.split('?', 1)[1] if '?' in report_url else ''
+        return interpret_report_url(self.base_url, export_url.replace('{query}', query))
+
+    def __find_stream_table_export_url(self, report_url):
+        """Reads the URL the report page's export button downloads from.
+
+        This only works when the button carries the URL in its href or a data attribute. When the button builds
+        the request in JavaScript instead, a ValueError is raised and the export_url has to be passed.
+        """
+        self.driver.get(interpret_report_url(self.base_url, report_url))
+        elem = WebDriverWait(self.driver, self.wait_time).until(
+            EC.presence_of_element_located((By.CLASS_NAME, 'export-table')))
+
+        for attribute in ['href', 'data-href', 'data-url', 'data-export-url']:
+            url = elem.get_attribute(attribute)
+            if url and not url.endswith('#') and not url.startswith('javascript:'):
+                return interpret_report_url(self.base_url, url)
+
+        raise ValueError('Could not find the export URL on the export button for {}. Pass the export_url that '
+                         'the button requests (from the browser\'s network tab), using {{query}} for the report '
+                         'url\'s query string.'.format(report_url))
+
+    def __read_stream_table_export(self, session, export_download_url, pandas_read_csv_kwargs={}):
+        """Streams a data-stream-table CSV export into a Pandas DataFrame.
+
+        Args:
+            session (requests.Session): A session logged into SchoolMint with the report's school year selected.
+            export_download_url (string): The full URL of the CSV export.
+            pandas_read_csv_kwargs: additional arguments to pass to Pandas read_csv
+        """
+        self.log.info('Getting export at: {}'.format(export_download_url))
+        with session.get(export_download_url, stream=True) as response:
+            response.raise_for_status()
+            if 'html' in response.headers.get('Content-Type', ''):
+                raise ValueError('SchoolMint returned a web page rather than a CSV export from: {}'.format(
+                    export_download_url))
+
+            # let urllib3 undo any gzip/deflate encoding while Pandas reads the stream
+            response.raw.decode_content = True
+            report_df = pd.read_csv(response.raw,
+                                    **dict({'encoding': SCHOOLMINT_DEFAULT_EXPORT_ENCODING}, **pandas_read_csv_kwargs))
+
+        # if the dataframe is empty (the report had no data), raise an error
+        if report_df.shape[0] == 0:
+            raise ValueError('No data in report for user {} at url: {}'.format(self.username, export_download_url))
+
+        return report_df
+
+    def __install_network_idle_tracker(self):
+        """Installs NETWORK_IDLE_TRACKER_SCRIPT in every page the driver loads from now on."""
+        try:
+            self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument',
+                                        {'source': NETWORK_IDLE_TRACKER_SCRIPT})
+        except (AttributeError, WebDriverException) as e:
+            self.log.debug('Could not install the network idle tracker: {}'.format(e))
+
+    def __wait_for_network_idle(self):
+        """Waits until the page's own XHR and fetch requests have finished and stayed quiet.
+
+        Returns:
+            bool: True once the page is idle. False if the tracker isn't installed or the page is still making
+                requests after wait_time seconds, in which case the caller should fall back to another check.
+        """
+        quiet_period_ms = int(STREAM_TABLE_QUIET_PERIOD * 1000)
+        if self.driver.execute_script(NETWORK_IDLE_CHECK_SCRIPT, quiet_period_ms) is None:
+            self.log.debug('Network idle tracker is not installed.')
+            return False
+
+        try:
+            WebDriverWait(self.driver, self.wait_time, poll_frequency=STREAM_TABLE_QUIET_PERIOD / 2).until(
+                lambda driver: driver.execute_script(NETWORK_IDLE_CHECK_SCRIPT, quiet_period_ms))
+        except TimeoutException:
+            self.log.debug('Page still had requests in flight after {} seconds.'.format(self.wait_time))
+            return False
+
+        return True
+
+    def __wait_for_report_data_summary_to_settle(self):
+        """Waits until the report-data-summary text stops changing, checking it every few seconds."""
         prev_data_summary_elem = self.driver.find_element(By.ID, 'report-data-summary').text
         # print(prev_data_summary_elem)
         time.sleep(1)
@@ -294,37 +791,6 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
             if count >= self.wait_time:
                 raise TimeoutError('SchoolMint Report Data never did not fully load within %d' % self.wait_time)
 
-        # click the button to download the report
-        self.log.debug('Starting download...')
-        elem = self.driver.find_element(By.CLASS_NAME, "export-table")
-        elem.click()
-
-        # wait until file has downloaded to close the browser. We can do this
-        # because we delete the file before we return it, so the temp dir should
-        # always be empty when this command is run
-        wait_for_any_file_in_folder(csv_download_folder_path, "csv")
-
-        self.log.debug('Download finished.')
-        report_df = pd.read_csv(get_most_recent_file_in_dir(csv_download_folder_path),
-                                encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING, **pandas_read_csv_kwargs)
-
-        # TODO: move this out of this function. It should happen as cleanup once
-        # the whole DAG has completed
-        #delete_folder_contents(csv_download_folder_path)
-        shutil.rmtree(csv_download_folder_path)
-
-        # close the driver for this task
-        self.driver.close()
-
-        # if the dataframe is empty (the report had no data), raise an error
-        if report_df.shape[0] == 0:
-            #delete_folder_contents(csv_download_folder_path)
-            shutil.rmtree(csv_download_folder_path)
-            raise ValueError('No data in report for user {} at url: {}'.format(
-                self.username, interpret_report_url(self.base_url, report_url)))
-
-        return report_df
-
     def __get_number_of_pages(self):
         """Get the number of pages in a SchoolMint pagination."""
         total_num_pages_xpath = '//*[@id="content"]//*[@class="pagination "]/li[@data-page][last()]'
@@ -338,7 +804,38 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
 
     def __navigate_to_custom_report(self, report_name, school_year,
                                     download_folder_path=None):
-        """Navigate to the page of the custom report tool that has the custom report on it"""
+        """Navigate to the page of the custom report tool that has the custom report on it
+
+        The page each report is on is looked up in an index of the custom reports (see __index_custom_reports),
+        which is rebuilt with a single walk through every page whenever the report isn't where it is expected.
+        """
+        self.__open_custom_reports(school_year, download_folder_path)
+
+        return self.__find_custom_report(report_name, school_year)
+
+    def __find_custom_report(self, report_name, school_year):
+        """Goes to the page of the custom reports table that a report is on, from any page of the table.
+
+        A report whose name is exactly report_name is preferred. If there isn't one, the first report whose
+        name contains report_name is used, as the custom reports used to be searched by substring.
+        """
+        location = self.__get_custom_report_location(report_name, school_year)
+        if location is not None and not self.__go_to_custom_report(location, report_name):
+            self.log.debug('{} has moved since the custom reports were indexed.'.format(report_name))
+            location = None
+        if location is None:
+            self.log.debug('Indexing custom reports to find: {}'.format(report_name))
+            locations = self.__index_custom_reports(school_year)
+            location = locations.get(report_name)
+            if location is None:
+                location = next((location for name, location in locations.items() if report_name in name), None)
+            if location is None or not self.__go_to_custom_report(location, report_name):
+                raise ReportNotFound
+
+        return location['page']
+
+    def __open_custom_reports(self, school_year, download_folder_path=None):
+        """Starts a driver, logs in and goes to the first page of the custom reports for a school year."""
         if not download_folder_path:
             download_folder_path = self.temp_folder_path
         self.driver = DriverBuilder().get_driver(
@@ -348,42 +845,140 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         self._login()
         # Clear pop-ups by reloading page
         self.driver.get(self.base_url)
-        self._set_year(school_year, self.driver)
+        self.__select_school_year(school_year)
 
         # get the custom reports page
         custom_reports_url = 'report/customReports'
         self.driver.get(interpret_report_url(self.base_url, custom_reports_url))
         self.__remove_walk_me_and_support()
+        self.__custom_reports_page = 0
 
-        # wait for the page to load and get the maximum number of pages
-        total_num_pages_xpath = '//*[@id="content"]//*[@class="pagination "]/li[@data-page][last()]'
+    def __get_custom_report_index_path(self):
+        return os.path.join(getattr(self, 'temp_folder_path', None) or gettempdir(),
+                            SCHOOLMINT_CUSTOM_REPORT_INDEX_FILENAME)
 
-        elem = WebDriverWait(self.driver, self.wait_time).until(
-            EC.presence_of_element_located((By.XPATH, total_num_pages_xpath)))
+    def __get_custom_report_index(self):
+        """Returns the custom report index for this hostname, loading the saved index on first use."""
+        if self.__custom_report_index is None:
+            try:
+                with open(self.__get_custom_report_index_path()) as f:
+                    self.__custom_report_index = json.load(f).get(self.hostname, dict())
+            except (IOError, ValueError):
+                self.__custom_report_index = dict()
 
-        num_pages = int(elem.get_attribute("data-page")) + 1
+        return self.__custom_report_index
 
-        current_page = 0
-        while current_page < num_pages:
-            report_name_xpath = "//tr[td//text()[contains(., '{}')]]".format(
-                report_name
-            )
+    def __get_custom_report_location(self, report_name, school_year):
+        """Looks up where a custom report was last seen.
 
-            try:
-                elem = self.driver.find_element(By.XPATH, report_name_xpath)
-                return current_page
-            except NoSuchElementException:
-                current_page += 1
-                if current_page < num_pages:
-                    next_page_xpath = '//*[@id="content"]//*[@class="pagination "]/li[@data-page={}]/a'.format(
-                        current_page
-                    )
-                    self.driver.find_element(By.XPATH, next_page_xpath).click()
+        Returns:
+            A dict with the 'page' and 'row_id' of the report, or None if it has not been indexed.
+        """
+        return self.__get_custom_report_index().get(school_year, dict()).get(report_name)
 
-                    # scroll back to the top of the page, prevents selenium clicking errors
-                    self.driver.execute_script("window.scrollTo(0, 0);")
+    def __scan_custom_reports(self):
+        """Reads every row of the custom reports table, one page at a time.
 
-        raise ReportNotFound
+        Returns:
+            list: A dict for each report with its 'name', 'row_id', 'button_text', 'last_generated' text and 'page'.
+        """
+        num_pages = self.__get_number_of_pages()
+        reports = list()
+        for page in range(num_pages):
+            self.__go_to_custom_reports_page(page)
+            for row in self.driver.execute_script(CUSTOM_REPORT_ROWS_SCRIPT):
+                if row['name']:
+                    row['page'] = page
+                    reports.append(row)
+
+        return reports
+
+    def __index_custom_reports(self, school_year, reports=None):
+        """Records where each custom report is, walking every page of the custom reports table.
+
+        The index is kept on the object and saved to the temp folder so that later lookups, including from
+        other runs, can go straight to a report's page.
+
+        Args:
+            school_year (string): The school year the custom reports are for.
+            reports (list): Rows from __scan_custom_reports. If not passed, the table is scanned.
+        Returns:
+            dict: The page and row id of every custom report, keyed by report name.
+        """
+        if reports is None:
+            reports = self.__scan_custom_reports()
+        locations = dict()
+        for row in reports:
+            if row['name'] not in locations:
+                locations[row['name']] = {'page': row['page'], 'row_id': row['row_id']}
+
+        self.__get_custom_report_index()[school_year] = locations
+        index_path = self.__get_custom_report_index_path()
+        try:
+            with open(index_path) as f:
+                saved_index = json.load(f)
+        except (IOError, ValueError):
+            saved_index = dict()
+        saved_index[self.hostname] = self.__custom_report_index
+        with open(index_path, 'w') as f:
+            json.dump(saved_index, f)
+
+        return locations
+
+    def __go_to_custom_reports_page(self, page):
+        """Clicks through to a page of the custom reports table.
+
+        The pagination doesn't always link to every page, so if there is no link to the page, the linked page
+        closest to it is clicked, and so on until the page is linked to.
+        """
+        while self.__custom_reports_page != page:
+            if self.driver.find_elements(By.XPATH, CUSTOM_REPORTS_PAGE_XPATH.format(page)):
+                next_page = page
+            else:
+                linked_pages = [
+                    int(elem.get_attribute('data-page'))
+                    for elem in self.driver.find_elements(By.XPATH, CUSTOM_REPORTS_LINKED_PAGES_XPATH)
+                ]
+                pages_on_the_way = [
+                    linked_page for linked_page in linked_pages
+                    if min(self.__custom_reports_page, page) < linked_page < max(self.__custom_reports_page, page)
+                ]
+                if not pages_on_the_way:
+                    raise NoSuchElementException('There is no link towards page {} of the custom reports'.format(
+                        page))
+                next_page = min(pages_on_the_way, key=lambda linked_page: abs(page - linked_page))
+            self.__click_custom_reports_page(next_page)
+
+    def __click_custom_reports_page(self, page):
+        """Clicks the link to a page of the custom reports table and waits for its rows to be replaced."""
+        first_row = self.driver.find_element(By.XPATH, '//*[@id="content"]//tr[.//button]')
+        self.driver.find_element(By.XPATH, CUSTOM_REPORTS_PAGE_XPATH.format(page)).click()
+        try:
+            WebDriverWait(self.driver, self.wait_time).until(EC.staleness_of(first_row))
+        except TimeoutException:
+            self.log.debug('Custom reports table did not re-render after moving to page {}'.format(page))
+        self.__custom_reports_page = page
+
+        # scroll back to the top of the page, prevents selenium clicking errors
+        self.driver.execute_script("window.scrollTo(0, 0);")
+
+    def __go_to_custom_report(self, location, report_name):
+        """Goes to an indexed custom report's page.
+
+        Returns:
+            bool: True if the report is on that page, False if the index is out of date.
+        """
+        try:
+            self.__go_to_custom_reports_page(location['page'])
+        except NoSuchElementException:
+            return False
+
+        if location['row_id']:
+            row_xpath = "//tr[@id='{}'][td//text()[contains(., '{}')]]".format(location['row_id'], report_name)
+        else:
+            row_xpath = "//tr[td//text()[contains(., '{}')]]".format(report_name)
+
+        return len(self.driver.find_elements(By.XPATH, row_xpath)) > 0
 
     def generate_custom_report(self, report_name, school_year):
         """
@@ -461,6 +1056,36 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
 
         return report_generated_on_text
 
+    def get_custom_report_statuses(self, school_year):
+        """Gets the status of every SchoolMint Custom Report in one pass through the custom reports table.
+
+        Also refreshes the index of which page each report is on (see __navigate_to_custom_report).
+
+        Args:
+            school_year (string): The SchoolMint school year (e.g. '2018-2019')
+
+        Returns: A Pandas DataFrame with a row for each report and the columns:
+            report_name, button_text ('Generate Report' or 'Report in Progress'), is_generating,
+            last_generated (a datetime, NaT if it could not be parsed), last_generated_text and page.
+        """
+        self.__open_custom_reports(school_year)
+        try:
+            if not self.check_school_year(school_year):
+                raise ReportNotFound("Wrong school year detected on the custom reports page.")
+            reports = self.__scan_custom_reports()
+        finally:
+            self.driver.close()
+
+        self.__index_custom_reports(school_year, reports)
+
+        df_statuses = pd.DataFrame(reports, columns=['name', 'button_text', 'last_generated', 'page'])
+        df_statuses = df_statuses.rename(columns={'name': 'report_name', 'last_generated': 'last_generated_text'})
+        df_statuses['is_generating'] = df_statuses['button_text'] == 'Report in Progress'
+        df_statuses['last_generated'] = pd.to_datetime(df_statuses['last_generated_text'], errors='coerce')
+
+        return df_statuses[['report_name', 'button_text', 'is_generating', 'last_generated',
+                            'last_generated_text', 'page']]
+
     def _download_custom_report(self, report_name, school_year, download_folder_path, download_if_generating=False):
         """Protected function for clicking the download button on a report on the Custom Reports page"""
         if not download_folder_path:
@@ -471,9 +1096,7 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         generate_report_button_text = WebDriverWait(self.driver, self.wait_time).until(
             EC.presence_of_element_located((By.XPATH, generate_report_button_xpath))).text
 
-        download_button_xpath = (
-            "//tr[td[text() = '{report_name}' or text() = ' {report_name} ']]//a[contains(text(), 'Download')]"
-        ).format(report_name=report_name)
+        download_button_xpath = DOWNLOAD_REPORT_LINK_XPATH.format(report_name=report_name)
 
         elem = WebDriverWait(self.driver, self.wait_time).until(
             EC.presence_of_element_located((By.XPATH, download_button_xpath)))
@@ -500,17 +1123,24 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         # always be empty when this command is run
         wait_for_any_file_in_folder(csv_download_folder_path, "csv")
 
-        report_df = pd.read_csv(get_most_recent_file_in_dir(csv_download_folder_path),
-                                encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING, **pandas_read_csv_kwargs)
-
-        # delete any files in the mealtime temp folder; we don't need them now
-        # TODO: move this out of this function. It should happen as cleanup once
-        # the whole DAG has completed
-        delete_folder_contents(csv_download_folder_path)
-
         # close the driver for this task
         driver.close()
 
+        try:
+            report_df = self._read_csv_custom_report(get_most_recent_file_in_dir(csv_download_folder_path),
+                                                     report_name, pandas_read_csv_kwargs)
+        finally:
+            # delete any files in the mealtime temp folder; we don't need them now
+            # TODO: move this out of this function. It should happen as cleanup once
+            # the whole DAG has completed
+            delete_folder_contents(csv_download_folder_path)
+
+        return report_df
+
+    def _read_csv_custom_report(self, file_path, report_name, pandas_read_csv_kwargs={}):
+        """Reads a downloaded single CSV custom report, raising NoDataError if it is empty."""
+        report_df = pd.read_csv(file_path, encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING, **pandas_read_csv_kwargs)
+
         # if the dataframe is empty (the report had no data), raise an error
         if report_df.shape[0] == 0:
             raise NoDataError('No data for user {} in Custom Report: {}'.format(self.username, report_name))
@@ -519,7 +1149,7 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
 
     def download_zip_custom_report(self, report_name, school_year, download_folder_path=None,
                                    download_if_generating=False, unzip=True,
-                                   pandas_read_csv_kwargs={}):
+                                   pandas_read_csv_kwargs={}, prefetch_workers=0, lazy=False):
         """
         Downloads a SchoolMint Custom Report that downloads as a zipped set of CSVs
         :param report_name: The name of the report exactly as it is shown in the SchoolMint UI
@@ -528,11 +1158,16 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         :param download_folder_path: The path to where you want to store the zip file.
         :param download_if_generating: Whether or not to download a custom report if the
             report is currently generating.
-        :param unzip: Boolean. If True, not only downloads the file, but also unzips it and
-            returns each csv in a Pandas Dataframe in a dictionary.
+        :param unzip: Boolean. If True, not only downloads the file, but also reads each csv
+            in it into a Pandas Dataframe (see ZipCustomReport).
         :param pandas_read_csv_kwargs: Additional keyward arguments to pass to Panda's read_csv function.
-        :return: None or a dictionary of Pandas DataFrames representing each of the CSVs in
-            the zipped file.
+        :param prefetch_workers: The number of threads used to parse the csvs. By default, the csvs are parsed
+            on ZIP_CUSTOM_REPORT_PARSE_WORKERS threads. With lazy=True, the threads start parsing every csv in
+            the background, and if it is 0 (the default), each csv is only parsed when it is first accessed.
+        :param lazy: If True, return a read-only ZipCustomReport that parses each csv when it is first
+            accessed instead of a dictionary with every csv already parsed.
+        :return: None or a dictionary of Pandas DataFrames representing each of the CSVs in the zipped
+            file, keyed by csv file name (a ZipCustomReport if lazy is True).
         """
         # create a folder for this specific run
         run_time = datetime.datetime.utcnow()
@@ -551,28 +1186,102 @@ class SchoolMint(WebUIDataSource, LoggingMixin):
         driver.close()
 
         if unzip:
-            # unzip the files
             file_path = max(glob.iglob(download_dir_final + '/*.zip'), key=os.path.getctime)
-            ZipfileLongPaths(file_path).extractall(download_dir_final)
-
-            dfs = dict()
-            # iterate through the unzipped files and load them into dataframes
-            for csv_filepath in glob.iglob(download_dir_final + '/*.csv'):
-                csv_filename = os.path.basename(csv_filepath)
-                #print(csv_filename)
-                # find the files that start with a number, these are the custom forms files
-                if re.match("^(\d+)", csv_filename):
-                    num_beg = re.match("^(\d+)", csv_filename).group(0)
-                    words = re.findall("[A-Za-z]+", csv_filename)
-                    dict_key = csv_filename # "{}_{}".format(num_beg, '_'.join(words[0:3])).lower()
-                    dfs[dict_key] = pd.read_csv(csv_filepath, encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING,
-                                                skiprows=[0, 2], **pandas_read_csv_kwargs)
-                # otherwise it is the info file that comes along with the zip export (application-data-export, etc.)
-                else:
-                    words = re.findall("[A-Za-z]+", csv_filename)
-                    dict_key = csv_filename # "{}".format('_'.join(words[0:3])).lower()
-
-                    dfs[dict_key] = pd.read_csv(csv_filepath, encoding=SCHOOLMINT_DEFAULT_EXPORT_ENCODING,
-                                                **pandas_read_csv_kwargs)
-
-            return dfs
+
+            if lazy:
+                return ZipCustomReport(file_path, pandas_read_csv_kwargs, prefetch_workers)
+            else:
+                return dict(ZipCustomReport(file_path, pandas_read_csv_kwargs,
+                                            prefetch_workers or ZIP_CUSTOM_REPORT_PARSE_WORKERS))
+
+    def generate_and_download_custom_reports(self, report_names, school_year, download_folder_path=None,
+                                             poll_frequency=30, timeout=3600, max_parse_workers=4,
+                                             pandas_read_csv_kwargs={}):
+        """
+        Generates several SchoolMint Custom Reports and downloads each one as soon as it has finished, all in
+        one browser session. Generate is clicked for every report up front, then the custom reports table is
+        scanned every poll_frequency seconds and each report is downloaded once its button is back to
+        'Generate Report'. Downloaded files are parsed on a thread pool while the remaining reports generate,
+        so the whole batch takes about as long as the slowest report.
+        :param report_names: A list of report names exactly as they are shown in the SchoolMint UI.
+        :param school_year: The year in SchoolMint. Should be formatted as shown in the UI (e.g. '2018-2019')
+        :param download_folder_path: The path under which a folder for this run's downloads is created.
+        :param poll_frequency: Seconds to wait between scans of the custom reports table.
+        :param timeout: Seconds to wait for all of the reports to finish generating.
+        :param max_parse_workers: The number of threads used to parse downloaded reports.
+        :param pandas_read_csv_kwargs: Additional keyward arguments to pass to Panda's read_csv function.
+        :return: A dictionary keyed by report name of a Pandas DataFrame for single CSV reports, or of a
+            dictionary of Pandas DataFrames keyed by csv file name for zipped reports.
+        """
+        run_time = datetime.datetime.utcnow()
+        if not download_folder_path:
+            download_folder_path = self.temp_folder_path
+        download_dir_final = "{}/custom-reports-{}-{}".format(download_folder_path, run_time.strftime('%Y%m%d'),
+                                                              run_time.strftime('%H%M%S'))
+
+        self.__open_custom_reports(school_year, download_dir_final)
+        futures = dict()
+        with ThreadPoolExecutor(max_workers=max_parse_workers) as executor:
+            try:
+                if not self.check_school_year(school_year):
+                    raise ReportNotFound("Wrong school detected prior to clicking generate.")
+
+                for report_name in report_names:
+                    self.__find_custom_report(report_name, school_year)
+                    generate_report_button = WebDriverWait(self.driver, self.wait_time).until(
+                        EC.presence_of_element_located(
+                            (By.XPATH, GENERATE_REPORT_BUTTON_XPATH.format(report_name=report_name))))
+                    if generate_report_button.text == 'Generate Report':
+                        generate_report_button.click()
+                        time.sleep(1)  # SchoolMint needs a short amount of time to register the click
+                    elif generate_report_button.text == 'Report in Progress':
+                        self.log.info('{} is already generating.'.format(report_name))
+                    else:
+                        raise ValueError("Unknown 'Generate Report' button text found")
+
+                deadline = time.time() + timeout
+                pending_report_names = list(report_names)
+                while pending_report_names:
+                    remaining_time = deadline - time.time()
+                    if remaining_time <= 0:
+                        raise ReportNotReady('Custom reports did not finish generating within {} seconds: {}'.format(
+                            timeout, ', '.join(pending_report_names)))
+                    time.sleep(min(poll_frequency, remaining_time))
+
+                    reports = self.__scan_custom_reports()
+                    self.__index_custom_reports(school_year, reports)
+                    button_texts = {row['name']: row['button_text'] for row in reports}
+                    for report_name in list(pending_report_names):
+                        if button_texts.get(report_name) != 'Generate Report':
+                            continue
+                        self.log.info('{} has finished generating, downloading it.'.format(report_name))
+                        file_path = self.__download_custom_report_file(report_name, school_year, download_dir_final)
+                        futures[report_name] = executor.submit(self.__read_custom_report_file, file_path,
+                                                               report_name, pandas_read_csv_kwargs)
+                        pending_report_names.remove(report_name)
+            finally:
+                self.driver.close()
+
+            return {report_name: futures[report_name].result() for report_name in report_names}
+
+    def __download_custom_report_file(self, report_name, school_year, download_folder_path):
+        """Clicks a custom report's download link in the current session and waits for the file to arrive."""
+        self.__find_custom_report(report_name, school_year)
+        existing_files = os.listdir(download_folder_path) if os.path.isdir(download_folder_path) else []
+        WebDriverWait(self.driver, self.wait_time).until(
+            EC.presence_of_element_located((By.XPATH, DOWNLOAD_REPORT_LINK_XPATH.format(report_name=report_name)))
+        ).click()
+
+        file_path = wait_for_new_file_in_folder(download_folder_path, existing_files)
+        if file_path is None:
+            raise TimeoutError('Custom Report {} did not finish downloading.'.format(report_name))
+
+        return file_path
+
+    def __read_custom_report_file(self, file_path, report_name, pandas_read_csv_kwargs={}):
+        """Reads a downloaded custom report. Every csv in a zip file is parsed here, so that the parsing
+        happens on the thread pool this runs on and parse errors are raised from it."""
+        if file_path.endswith('.zip'):
+            return dict(ZipCustomReport(file_path, pandas_read_csv_kwargs))
+        else:
+            return self._read_csv_custom_report(file_path, report_name, pandas_read_csv_kwargs)
@@ -9,11 +9,21 @@ from requests.packages.urllib3.util.retry import Retry
 import logging
 import sys
 import zipfile
+import imaplib
+import itertools
+import re
+import select
+import ssl
+import pandas as pd
+import numpy as np
 
 from selenium.webdriver import Chrome
 from selenium.webdriver.chrome import webdriver as chrome_webdriver
 
 LOGGER = logging.getLogger('ducttape.utils')
+# Numbers for the tags of IDLE commands, which are prefixed with DUCTTAPE. imaplib's own tags only use the
+# letters A-P, so they can't clash with these.
+IMAP_IDLE_TAG_NUMBERS = itertools.count(1)
 
 
 def requests_retry_session(
@@ -36,6 +46,23 @@ def requests_retry_session(
     return session
 
 
+def requests_session_from_driver(driver, session=None):
+    """Copies the cookies of a logged in Selenium driver into a requests session so that
+    follow-up HTTP calls are made as the same user without going through the browser.
+
+    Args:
+        driver: A Selenium web driver that has already logged in.
+        session (requests.Session): An existing session to add the cookies to. A new
+            one is created if this is not provided.
+    Returns:
+        The requests.Session carrying the driver's cookies.
+    """
+    session = session or requests.Session()
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'])
+    return session
+
+
 def delete_folder_contents(folder_path):
     """Deletes all files and subfolders in a specific folder.
 
@@ -134,6 +161,362 @@ def wait_for_any_file_in_folder(folder_path, file_format=None, timeout=60):
     return False
 
 
+# suffixes browsers give files that are still downloading
+PARTIAL_DOWNLOAD_SUFFIXES = ('.crdownload', '.part', '.tmp')
+
+
+def wait_for_new_file_in_folder(folder_path, existing_files=(), timeout=60):
+    """
+    Waits until a file that isn't in existing_files has finished downloading into a folder.
+    Unlike wait_for_any_file_in_folder, this works on a folder that already has files in it,
+    so one browser can download several files into the same folder one after another.
+
+    Args:
+        folder_path (string): The folder the file is downloading to.
+        existing_files (iterable): The names of files that were in the folder before the download started.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        string: The path to the new file, or None if no file finished downloading before the timeout.
+    """
+    existing_files = set(existing_files)
+    deadline = time.time() + timeout
+    while True:
+        if os.path.isdir(folder_path):
+            names = os.listdir(folder_path)
+            is_downloading = any(name.endswith(PARTIAL_DOWNLOAD_SUFFIXES) for name in names)
+            new_files = [name for name in names
+                         if name not in existing_files and not name.endswith(PARTIAL_DOWNLOAD_SUFFIXES) and
+                         os.path.isfile(os.path.join(folder_path, name))]
+            if new_files and not is_downloading:
+                return os.path.join(folder_path, new_files[0])
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.5)
+
+
+def wait_for_imap_idle_update(imap_conn, timeout):
+    """
+    Blocks on an IMAP IDLE command (RFC 2177) until the server reports a change
+    in the selected mailbox or the timeout elapses.
+
+    imaplib has no IDLE support, so this works around it: the IDLE command is
+    sent with its own DUCTTAPE<n> tag, outside of imaplib's tag bookkeeping, and
+    buffered responses are found by peeking at imaplib.IMAP4's undocumented
+    file attribute (the buffered reader behind its readline()). Both could
+    break with a different imaplib, which is why callers should make IDLE opt-in.
+
+    Args:
+        imap_conn (imaplib.IMAP4): An authenticated connection with a mailbox
+            selected. The server must advertise the IDLE capability.
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        bool: True if the server reported new messages; False if the timeout
+            elapsed first.
+    """
+    tag = 'DUCTTAPE{}'.format(next(IMAP_IDLE_TAG_NUMBERS)).encode('ascii')
+    imap_conn.send(tag + b' IDLE\r\n')
+    response = imap_conn.readline()
+    if not response.startswith(b'+'):
+        raise imaplib.IMAP4.error('IDLE rejected by server: {}'.format(response))
+
+    sock = imap_conn.socket()
+    deadline = time.time() + timeout
+    new_messages = False
+    try:
+        while not new_messages:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # lines that arrived along with an earlier one are already buffered, where select() can't see them
+            if not _imap_has_unread_data(imap_conn, sock):
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+            line = imap_conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort('Connection closed during IDLE')
+            if line.startswith(b'*') and line.rstrip().upper().endswith(b'EXISTS'):
+                new_messages = True
+    except BaseException:
+        # the connection may be what failed, so don't let ending IDLE hide the original error
+        try:
+            _end_imap_idle(imap_conn, tag)
+        except (OSError, imaplib.IMAP4.error) as err:
+            LOGGER.debug('Could not end IDLE after an error: {}'.format(err))
+        raise
+
+    _end_imap_idle(imap_conn, tag)
+
+    return new_messages
+
+
+def _end_imap_idle(imap_conn, tag):
+    """Ends an IDLE command and reads the responses up to its tagged completion."""
+    imap_conn.send(b'DONE\r\n')
+    # drain any untagged responses until the IDLE command completes
+    while True:
+        line = imap_conn.readline()
+        if not line or line.startswith(tag):
+            break
+
+
+def parse_imap_list(text):
+    """
+    Parses the first parenthesized list in an IMAP response, such as a BODYSTRUCTURE,
+    into nested Python lists. Quoted strings and atoms (including numbers) become
+    strings and NIL becomes None. Literals ({n}) aren't supported.
+
+    Args:
+        text (string): The response text, starting at or before the list.
+
+    Returns:
+        list: The parsed list, or None if the text has no complete list.
+    """
+    stack = []
+    for token in re.findall(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+', text):
+        if token == '(':
+            stack.append([])
+        elif not stack:
+            # skip anything before the list starts
+            continue
+        elif token == ')':
+            items = stack.pop()
+            if not stack:
+                return items
+            stack[-1].append(items)
+        elif token.startswith('"'):
+            stack[-1].append(re.sub(r'\\(.)', r'\1', token[1:-1]))
+        elif token.upper() == 'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token)
+
+    return None
+
+
+def find_imap_text_plain_part(bodystructure, section=''):
+    """
+    Finds the first text/plain part of an email from its BODYSTRUCTURE (RFC 3501),
+    so that only that part needs to be fetched.
+
+    Args:
+        bodystructure (list): A BODYSTRUCTURE parsed with parse_imap_list.
+        section (string): The section number of bodystructure within the email.
+            Only used when recursing into multipart parts.
+
+    Returns:
+        tuple: The (section, content transfer encoding, charset) of the part,
+            e.g. ('1.1', 'quoted-printable', 'utf-8'), or None if there isn't one.
+            Fetch the part with BODY.PEEK[<section>].
+    """
+    if bodystructure and isinstance(bodystructure[0], list):
+        # a multipart body lists its parts first, then its subtype and extension data
+        parts = itertools.takewhile(lambda item: isinstance(item, list), bodystructure)
+        for number, part in enumerate(parts, 1):
+            text_part = find_imap_text_plain_part(part, '{}.{}'.format(section, number) if section else str(number))
+            if text_part is not None:
+                return text_part
+        return None
+
+    if len(bodystructure or []) > 5 and str(bodystructure[0]).lower() == 'text' \
+            and str(bodystructure[1]).lower() == 'plain':
+        parameters = bodystructure[2] or []
+        charset = {str(name).lower(): value for name, value in zip(parameters[::2], parameters[1::2])}.get('charset')
+        return section or '1', (bodystructure[5] or '7bit').lower(), charset
+
+    return None
+
+
+def _imap_has_unread_data(imap_conn, sock):
+    """
+    Whether an IMAP connection has data that can be read without blocking, either
+    in its buffered reader, in a decrypted SSL record or on the socket itself.
+    """
+    sock_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(imap_conn.file.peek())
+    except (ssl.SSLWantReadError, BlockingIOError):
+        return False
+    finally:
+        sock.settimeout(sock_timeout)
+
+
+def read_spreadsheet(file_path, sheet_name=0, header=0, usecols=None, dtype=None, **kwargs):
+    """
+    Reads a sheet from a spreadsheet file into a Pandas DataFrame using the reader
+    registered for the file's extension in SPREADSHEET_READERS. Files without a
+    registered reader are read with Pandas read_excel.
+
+    Args:
+        file_path (string): The path to the spreadsheet file.
+        sheet_name (string or int): The name or zero-based position of the sheet to read.
+        header (int): The zero-based row holding the column names, or None if there isn't one.
+        usecols (list): The names or positions of the columns to read. Reads all columns if None.
+        dtype (type or dict): A data type for all columns or a dict of column name -> data type.
+        **kwargs: additional arguments to pass to Pandas read_excel
+
+    Returns: A Pandas DataFrame of the sheet contents.
+    """
+    extension = os.path.splitext(file_path)[1].lstrip('.').lower()
+    reader = SPREADSHEET_READERS.get(extension, read_spreadsheet_with_pandas)
+    return reader(file_path, sheet_name=sheet_name, header=header, usecols=usecols, dtype=dtype, **kwargs)
+
+
+def register_spreadsheet_reader(extension, reader):
+    """
+    Registers the function read_spreadsheet uses for files with an extension.
+
+    Args:
+        extension (string): The file extension, without the leading '.'. Example: 'xlsx'
+        reader (callable): A function with the same signature as read_spreadsheet.
+    """
+    SPREADSHEET_READERS[extension.lower()] = reader
+
+
+def read_spreadsheet_with_pandas(file_path, sheet_name=0, header=0, usecols=None, dtype=None, **kwargs):
+    """Reads a sheet from a spreadsheet file with Pandas read_excel and its default engine."""
+    return pd.read_excel(file_path, sheet_name=sheet_name, header=header, usecols=usecols, dtype=dtype, **kwargs)
+
+
+def _dedupe_column_names(columns, unnamed_positions=()):
+    """Renames duplicate column names the way read_excel does: A, A.1, A.2, ...
+
+    Suffixes that are already used by another column are skipped, and unnamed columns are renamed after the
+    named ones so that the given names are kept.
+    """
+    columns = list(columns)
+    counts = dict()
+    loop_order = [ix for ix in range(len(columns)) if ix not in unnamed_positions] + list(unnamed_positions)
+    for ix in loop_order:
+        column = original_column = columns[ix]
+        count = counts.get(column, 0)
+        while count > 0:
+            counts[original_column] = count + 1
+            column = '{}.{}'.format(original_column, count)
+            if column in columns:
+                count += 1
+            else:
+                count = counts.get(column, 0)
+        columns[ix] = column
+        counts[column] = count + 1
+
+    return columns
+
+
+def _convert_excel_column(values, dtype):
+    """Converts one column of cell values to dtype the way read_excel does.
+
+    read_excel turns integral floats into ints before applying dtype, so a numeric id column read as
+    text gives '123456' rather than '123456.0', and blank cells stay missing rather than becoming 'None'.
+    """
+    values = [int(value) if isinstance(value, float) and value.is_integer() else value for value in values]
+    try:
+        is_text = np.dtype(dtype).kind == 'U'
+    except TypeError:
+        is_text = False
+
+    if is_text:
+        return pd.Series([np.nan if value is None else str(value) for value in values], dtype=object)
+    else:
+        return pd.Series(values, dtype=object).infer_objects().astype(dtype)
+
+
+def read_xlsx_streaming(file_path, sheet_name=0, header=0, usecols=None, dtype=None, **kwargs):
+    """
+    Reads a sheet from an xlsx workbook by streaming its rows with openpyxl's read-only mode.
+    Only the requested sheet is parsed and only the requested columns are kept, so large
+    workbooks are read in a fraction of the time and memory of read_excel.
+
+    Falls back to read_spreadsheet_with_pandas if openpyxl is not installed or if options
+    that this reader does not handle are passed (e.g. skiprows, all sheets, Excel column ranges).
+    """
+    try:
+        import openpyxl
+    except ImportError:
+        openpyxl = None
+
+    is_supported = (
+        openpyxl is not None and not kwargs and sheet_name is not None and
+        (header is None or isinstance(header, int)) and
+        (usecols is None or callable(usecols) or isinstance(usecols, (list, tuple)))
+    )
+    if not is_supported:
+        return read_spreadsheet_with_pandas(file_path, sheet_name=sheet_name, header=header, usecols=usecols,
+                                            dtype=dtype, **kwargs)
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        if isinstance(sheet_name, int):
+            worksheet = workbook.worksheets[sheet_name]
+        else:
+            worksheet = workbook[sheet_name]
+
+        rows = worksheet.iter_rows(values_only=True)
+        if header is None:
+            columns = None
+        else:
+            for _ in range(header):
+                next(rows, None)
+            columns = list(next(rows, ()))
+
+        data = [row for row in rows]
+    finally:
+        workbook.close()
+
+    # read-only mode reports the stored sheet dimensions, which can include formatted but empty rows
+    while data and all(value is None for value in data[-1]):
+        data.pop()
+
+    width = max([len(columns or ())] + [len(row) for row in data])
+    header_columns = None
+    if columns is None:
+        columns = list(range(width))
+    else:
+        columns = columns + [None] * (width - len(columns))
+        # name unnamed and duplicate columns the way read_excel does
+        unnamed_positions = [ix for ix, column in enumerate(columns) if column is None]
+        columns = [column if column is not None else 'Unnamed: {}'.format(ix) for ix, column in enumerate(columns)]
+        header_columns = columns
+        columns = _dedupe_column_names(columns, unnamed_positions)
+
+    if usecols is None:
+        column_positions = list(range(width))
+    elif callable(usecols):
+        column_positions = [ix for ix, column in enumerate(columns) if usecols(column)]
+    else:
+        column_positions = [ix if isinstance(ix, int) else columns.index(ix) for ix in usecols]
+        column_positions.sort()
+
+    records = [tuple(row[ix] if ix < len(row) else None for ix in column_positions) for row in data]
+    df = pd.DataFrame.from_records(records, columns=[columns[ix] for ix in column_positions])
+
+    # dtypes are applied to the cell values rather than to the inferred columns, which would be float
+    # wherever a numeric column has blanks
+    if dtype is not None:
+        for position, ix in enumerate(column_positions):
+            if not isinstance(dtype, dict):
+                column_dtype = dtype
+            elif columns[ix] in dtype:
+                column_dtype = dtype[columns[ix]]
+            else:
+                # like read_excel, a renamed duplicate column gets the dtype given for its header name
+                column_dtype = dtype.get(header_columns[ix]) if header_columns is not None else None
+            if column_dtype is not None:
+                df[columns[ix]] = _convert_excel_column([record[position] for record in records], column_dtype)
+
+    return df
+
+
+# readers used by read_spreadsheet, keyed by file extension
+SPREADSHEET_READERS = {
+    'xlsx': read_xlsx_streaming,
+    'xlsm': read_xlsx_streaming,
+}
+
+
 def correct_list_dataframe_dimensions(rows, columns):
 
     rows_modified = rows